@@ -0,0 +1,87 @@
+"""
+Syntax aware chunking of parsed entities for embedding.
+
+Entities that fit the token budget are embedded whole. Larger ones are split on
+the boundaries of their tree-sitter children (statements, methods, fields),
+falling back to line boundaries for leaves that are still too large, and the
+pieces are packed back together into chunks that fill the budget. Consecutive
+chunks share up to `overlap` tokens of trailing context.
+"""
+
+from typing import Callable, List, Tuple
+
+# (start_byte, end_byte, tokens)
+Unit = Tuple[int, int, int]
+
+
+def chunk_entity(entity, count_tokens: Callable[[str], int], max_tokens: int, overlap: int = 0) -> List[str]:
+    """Split an EntityRecord into chunks of at most max_tokens, as measured by count_tokens."""
+    text = entity.text
+    if not text.strip():
+        return []
+
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+
+    units = split_entity(entity, count_tokens, max_tokens)
+    return [entity.source.text(start, end) for start, end in pack_units(units, max_tokens, overlap)]
+
+
+def split_entity(entity, count_tokens: Callable[[str], int], max_tokens: int) -> List[Unit]:
+    """Break an entity into units that each fit max_tokens, preferring syntax boundaries."""
+    if not entity.children:
+        return split_lines(entity.source, entity.start_byte, entity.end_byte, count_tokens)
+
+    units = []
+    for child in entity.children:
+        if child.end_byte <= child.start_byte:
+            continue
+        tokens = count_tokens(child.text)
+        if tokens <= max_tokens:
+            units.append((child.start_byte, child.end_byte, tokens))
+        else:
+            units.extend(split_entity(child, count_tokens, max_tokens))
+    return units
+
+
+def split_lines(source, start_byte: int, end_byte: int, count_tokens: Callable[[str], int]) -> List[Unit]:
+    """Split a byte range on newlines. A single line over budget is kept whole and truncated by the model."""
+    units = []
+    line_start = start_byte
+    for line in bytes(source.view[start_byte:end_byte]).splitlines(keepends=True):
+        text = line.decode('utf8', errors='replace')
+        if text.strip():
+            units.append((line_start, line_start + len(line), count_tokens(text)))
+        line_start += len(line)
+    return units
+
+
+def pack_units(units: List[Unit], max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Greedily pack consecutive units into (start_byte, end_byte) chunks of at most max_tokens."""
+    chunks = []
+    current: List[Unit] = []
+    current_tokens = 0
+
+    for unit in units:
+        if current and current_tokens + unit[2] > max_tokens:
+            chunks.append((current[0][0], current[-1][1]))
+
+            # Carry trailing units over as overlap, without pushing the next chunk over budget
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                if carried_tokens + previous[2] > overlap or carried_tokens + previous[2] + unit[2] > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[2]
+
+            current = carried
+            current_tokens = carried_tokens
+
+        current.append(unit)
+        current_tokens += unit[2]
+
+    if current:
+        chunks.append((current[0][0], current[-1][1]))
+    return chunks
@@ -0,0 +1,95 @@
+import os
+import re
+import pathspec
+
+# Cache for compiled ignore rules, keyed by the .gitignore lines they were built from
+_rules_cache = {}
+
+def compile_ignore_rules(lines):
+    """
+        Compile gitignore lines into a list of (regex, ignore) rules. Consecutive patterns of the same
+        kind are merged into one combined regex, so a .gitignore without negations is a single regex.
+        Later rules take precedence, as in git.
+    """
+    key = tuple(line for line in lines if line and not line.startswith('#'))
+    if key in _rules_cache:
+        return _rules_cache[key]
+
+    pattern_type = pathspec.util.lookup_pattern('gitwildmatch')
+    patterns = [pattern for pattern in map(pattern_type, key) if pattern.include is not None]
+
+    rules = []
+    group = []
+    for i, pattern in enumerate(patterns):
+        # Named groups would clash once several patterns share one regex
+        group.append(re.sub(r'\(\?P<\w+>', '(?:', pattern.regex.pattern))
+        if i == len(patterns) - 1 or patterns[i + 1].include != pattern.include:
+            rules.append((re.compile('|'.join(f'(?:{regex})' for regex in group)), pattern.include))
+            group = []
+
+    _rules_cache[key] = rules
+    return rules
+
+class IgnoreMatcher:
+    """
+        Ignore rules of one directory level, chained to the closest parent level that has rules.
+        Each level's .gitignore is compiled once, so checking a path is one regex match per level
+        instead of rescanning every spec. Paths are absolute for a tree on disk, or relative to the
+        root for archive members (dir_path '').
+    """
+    __slots__ = ('dir_path', 'prefix_len', 'rules', 'parent')
+
+    def __init__(self, dir_path: str, rules: list, parent=None):
+        self.dir_path = dir_path
+        self.prefix_len = len(dir_path) + (0 if not dir_path or dir_path.endswith('/') else 1)
+        self.rules = rules
+        self.parent = parent
+
+    def for_directory(self, dir_path: str, lines):
+        """Matcher for a subdirectory with the given .gitignore lines, or this one if it adds no rules."""
+        rules = compile_ignore_rules(lines)
+        return IgnoreMatcher(dir_path, rules, self) if rules else self
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Check a path inside dir_path, the deepest level with a matching rule decides."""
+        matcher = self
+        while matcher is not None:
+            local_path = path[matcher.prefix_len:]
+            if is_dir:
+                local_path += '/'
+            for regex, ignore in reversed(matcher.rules):
+                if regex.match(local_path):
+                    return ignore
+            matcher = matcher.parent
+        return False
+
+class RepoIgnoreRules:
+    """
+        Ignore state of paths relative to a repository root, for trees that aren't on disk (archives,
+        pushed paths). Applies the root rules and the .gitignore of every directory on the way down,
+        and a file inside an ignored directory is ignored, as scan_directory does on disk.
+        gitignore_lines(rel_dir) returns the lines of a directory's .gitignore, [] when it has none,
+        and is called at most once per directory.
+    """
+
+    def __init__(self, root_lines, gitignore_lines):
+        self.root = IgnoreMatcher('', compile_ignore_rules(root_lines))
+        self.gitignore_lines = gitignore_lines
+        self.matchers = {}
+        self.ignored_dirs = {'': False}
+
+    def matcher_for(self, rel_dir: str) -> IgnoreMatcher:
+        if rel_dir not in self.matchers:
+            parent = self.matcher_for(os.path.dirname(rel_dir)) if rel_dir else self.root
+            self.matchers[rel_dir] = parent.for_directory(rel_dir, self.gitignore_lines(rel_dir))
+        return self.matchers[rel_dir]
+
+    def is_dir_ignored(self, rel_dir: str) -> bool:
+        if rel_dir not in self.ignored_dirs:
+            parent = os.path.dirname(rel_dir)
+            self.ignored_dirs[rel_dir] = self.is_dir_ignored(parent) or self.matcher_for(parent).is_ignored(rel_dir, True)
+        return self.ignored_dirs[rel_dir]
+
+    def is_ignored(self, rel_path: str) -> bool:
+        rel_dir = os.path.dirname(rel_path)
+        return self.is_dir_ignored(rel_dir) or self.matcher_for(rel_dir).is_ignored(rel_path)
@@ -1,116 +1,309 @@
-from tree_sitter import Parser
 import os
+import sys
 import time
 import argparse
-import pathspec
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, ExitStack
 from helix import Client, Instance
-from language_config import LANGUAGE_CONFIG
+try:
+    from .language_config import LANGUAGE_CONFIG
+    from .chunker import chunk_entity
+    from .ignore_rules import compile_ignore_rules, IgnoreMatcher, RepoIgnoreRules
+    from .parsing import MAX_DEPTH, parse_source
+except ImportError:
+    from language_config import LANGUAGE_CONFIG
+    from chunker import chunk_entity
+    from ignore_rules import compile_ignore_rules, IgnoreMatcher, RepoIgnoreRules
+    from parsing import MAX_DEPTH, parse_source
 from pathlib import Path
 import shutil
 import tempfile
 import zipfile
 import requests
+from urllib.parse import quote
+
+# src/helix is not a package (it would shadow helix-py), so import the embedder from its directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'helix'))
+from embedder import get_embedder, check_dimensions
 
 # Default patterns to always ignore
 DEFAULT_IGNORE_PATTERNS = ['.git/']
 
-# Parser Languages
+# Tokens of trailing context repeated at the start of the next chunk of an entity
+CHUNK_OVERLAP_TOKENS = 32
+
+# Number of vectors buffered before a bulk embedSuperEntities write
+EMBED_BATCH_SIZE = 128
+
+# Repository archives up to this size are buffered in memory, larger ones spill to disk
+ARCHIVE_SPOOL_SIZE = 64 * 1024 * 1024
 
-# Maximum depth of sub entities to process
-MAX_DEPTH = 2
+# Max archive members read ahead of the file workers when ingesting from an archive
+MAX_PENDING_FILES = 64
 
-# HelixDB Instance
-instance = Instance()
-time.sleep(1)
+# Where source text is stored, "inline" keeps it on every File and Entity node, "blob" stores
+# each file's text once in a Blob node keyed by its content hash and keeps only offsets on the
+# entities. Blob mode disables BM25 over Entity.text, hybrid search falls back to vectors alone
+TEXT_STORAGE = os.getenv("HELIX_TEXT_STORAGE", "inline")
 
 # HelixDB Client
 client = Client(local=True, verbose=False)
 
-# Thread pool for parallel processing
-MAX_WORKERS = min(os.cpu_count()//2, 8)
+# Thread pool for the I/O stage (directory walks and HelixDB writes)
+MAX_WORKERS = min((os.cpu_count() or 1) + 4, 32)
 executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-# Cache for seen files to avoid re-parsing
-seen_files = set()
+# Process pool for the CPU bound parse stage, tree-sitter parsing and entity building.
+# Started on first use from a forkserver, never forked from a process running threads, asyncio or the
+# embedding model, and its workers only import the parsing module
+PARSE_WORKERS = int(os.getenv("INDEX_PARSE_WORKERS", min(os.cpu_count() or 1, 4)))
+parse_pool = None
+parse_pool_lock = threading.Lock()
 
-# Cache for directory-specific PathSpecs
-spec_map = {}
+def get_parse_pool():
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+        return parse_pool
 
+# Per content hash [lock, users], so identical files written concurrently are parsed once and then linked
+content_locks = {}
+content_locks_lock = threading.Lock()
+
+# Serialises folder creation while syncing, so concurrent files don't create the same folder twice
+folder_lock = threading.Lock()
 
-# Modifiable helper functions
-# TODO: Replace with actual chunking function
-def chunk_entity(text:str):
-    return [text[i:i+1000] for i in range(0, len(text), 1000)]
 
-# TODO: Replace with actual embedding function
-def random_embedding(text:str):
-    return [0.1 for _ in range(768)]
+# Modifiable helper functions
+# Embedding backend, batched and cached on disk by content hash
+embedder = get_embedder()
 
-def download_github_repo(owner, repo, token=None, branch="main"):
+class EmbeddingBatcher:
+    """
+        Buffers the content vectors of one file and writes them to HelixDB in bulk.
+        write_super_entities flushes it before returning, so a file is only marked complete by
+        update_file once its vectors are stored, and a failed write fails that file's sync.
+        All vectors of a content go in the same batch, so a content is never left half embedded.
+    """
+    def __init__(self, batch_size=EMBED_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = []
+
+    def add(self, content_hash, vectors):
+        for vector in vectors:
+            check_dimensions(vector)
+        if self.pending and len(self.pending) + len(vectors) > self.batch_size:
+            self.flush()
+        self.pending.extend({'hash': content_hash, 'vector': vector} for vector in vectors)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            client.query('embedSuperEntities', {'embeddings': batch})
+
+def download_github_repo(owner, repo, token=None, branch="main", selective=True):
     """
         Download a GitHub repository as a zip archive and extract it.
+        With selective=True only parseable files and .gitignores that aren't ignored are extracted.
         Returns the path to the extracted directory.
     """
+    temp_dir = tempfile.mkdtemp(prefix=f"{owner}_{repo}_")
+
+    try:
+        with fetch_github_archive(owner, repo, token, branch) as zip_ref:
+            # GitHub prefixes every member with an "{owner}-{repo}-{sha}/" directory
+            prefix = archive_prefix(zip_ref)
+            if selective:
+                for info, _ in select_archive_members(zip_ref, prefix, include_gitignores=True):
+                    zip_ref.extract(info, temp_dir)
+            else:
+                zip_ref.extractall(temp_dir)
+
+        repo_path = os.path.join(temp_dir, prefix.rstrip('/'))
+        os.makedirs(repo_path, exist_ok=True)
+        return repo_path
+
+    except Exception as e:
+        # Clean up on error
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise e
+
+def fetch_github_archive(owner, repo, token=None, branch="main"):
+    """
+        Stream a repository zipball into a spooled buffer and open it, without a zip file on disk.
+        Archives larger than ARCHIVE_SPOOL_SIZE transparently spill over to an anonymous temp file.
+    """
     url = f"https://api.github.com/repos/{owner}/{repo}/zipball/{branch}"
     headers = {}
     if token:
         headers["Authorization"] = f"token {token}"
         headers["Accept"] = "application/vnd.github.v3+json"
-    temp_dir = tempfile.mkdtemp(prefix=f"{owner}_{repo}_")
 
-    try:
-        # Download the zip file
-        response = requests.get(url, headers=headers, stream=True)
+    buffer = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE)
+    with requests.get(url, headers=headers, stream=True) as response:
         response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            buffer.write(chunk)
 
-        zip_path = os.path.join(temp_dir, f"{repo}.zip")
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
 
-        # Write zip file to disk
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+def archive_prefix(zip_ref):
+    names = zip_ref.namelist()
+    if not names:
+        raise Exception("Empty repository archive")
+    return names[0].split('/')[0] + '/'
 
-        # Extract zip file
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
+def select_archive_members(zip_ref, prefix, include_gitignores=False):
+    """
+        Return (ZipInfo, relative path) for every archive member worth indexing: files with a
+        language in LANGUAGE_CONFIG that aren't matched by DEFAULT_IGNORE_PATTERNS or any .gitignore.
+    """
+    members = [(info, info.filename[len(prefix):]) for info in zip_ref.infolist() if not info.is_dir()]
 
-        # Remove zip file
-        os.remove(zip_path)
+    # Gitignore lines keyed by the relative directory they apply to
+    gitignores = {}
+    for info, rel_path in members:
+        if os.path.basename(rel_path) == '.gitignore':
+            gitignores[os.path.dirname(rel_path)] = zip_ref.read(info).decode('utf8', errors='replace').splitlines()
 
-        # Find the extracted directory (GitHub adds a prefix)
-        extracted_dirs = [d for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d))]
-        if extracted_dirs:
-            repo_path = os.path.join(temp_dir, extracted_dirs[0])
-            return repo_path
-        else:
-            raise Exception("No extracted directory found")
+    rules = RepoIgnoreRules(DEFAULT_IGNORE_PATTERNS, lambda rel_dir: gitignores.get(rel_dir, []))
 
-    except Exception as e:
-        # Clean up on error
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        raise e
+    selected = []
+    for info, rel_path in members:
+        name = os.path.basename(rel_path)
+        rel_dir = os.path.dirname(rel_path)
+        if rules.is_dir_ignored(rel_dir):
+            continue
+        if name == '.gitignore':
+            if include_gitignores:
+                selected.append((info, rel_path))
+            continue
+        if name.split('.')[-1] in LANGUAGE_CONFIG and not rules.is_ignored(rel_path):
+            selected.append((info, rel_path))
+
+    return selected
+
+def iter_github_repo(owner, repo, token=None, branch="main"):
+    """Yield (relative path, contents) for every indexable file, read straight from the streamed archive."""
+    with fetch_github_archive(owner, repo, token, branch) as zip_ref:
+        prefix = archive_prefix(zip_ref)
+        for info, rel_path in select_archive_members(zip_ref, prefix):
+            yield rel_path, zip_ref.read(info)
+
+def fetch_github_file(owner, repo, path, token=None, ref="main"):
+    """Fetch the raw contents of a single file from a GitHub repository."""
+    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{quote(path)}"
+    headers = {"Accept": "application/vnd.github.raw"}
+    if token:
+        headers["Authorization"] = f"token {token}"
+
+    response = requests.get(url, headers=headers, params={"ref": ref}, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+def fetch_gitignore(owner, repo, rel_dir, token=None, ref="main"):
+    """Lines of a directory's .gitignore in a GitHub repository, [] when it has none."""
+    try:
+        content = fetch_github_file(owner, repo, os.path.join(rel_dir, '.gitignore'), token, ref)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return []
+        raise
+    return content.decode('utf8', errors='replace').splitlines()
 
 # Ingestion function
-def ingestion(owner, repo_name, token=None):
+def ingestion(owner, repo_name, token=None, incremental=False, streaming=False):
+    if streaming:
+        ingest_archive(owner, repo_name, token, incremental)
+        return
+
     # Ensure root_path is absolute
     root_path = download_github_repo(owner, repo_name, token)
     root_path = os.path.abspath(root_path)
+    try:
+        ingest_tree(root_path, owner, repo_name, incremental)
+    finally:
+        # The checkout lives in the temporary directory download_github_repo created
+        shutil.rmtree(os.path.dirname(root_path), ignore_errors=True)
+
+def ingest_tree(root_path, owner, repo_name, incremental=False):
+    """Index a repository extracted to root_path"""
+    # Load the ignore rules of the root and its parents at the start
+    matcher = load_ignore_matcher(root_path)
+    root_dir = root_path
+
+    full_name = f"{owner}/{repo_name}"
+    repos = client.query('getRepository', {'full_name': full_name})[0]['repo']
+    if incremental:
+        if repos:
+            update_repository(root_path, owner, repo_name, matcher, root_dir)
+            return
+        print(f"{full_name} has not been indexed yet, running full ingestion")
+    elif repos:
+        # A full re-run replaces the stored files, folders are upserted and reused
+        stored_files, _ = load_indexed_tree(full_name)
+        delete_files(list(stored_files), stored_files)
+
+    root_id = client.query('upsertRepository', {'username': owner, 'repo_name': repo_name, 'full_name': full_name})[0]['repo'][0]['id']
+    populate(root_path, owner, repo_name, parent_id=root_id, matcher=matcher, root_dir=root_dir)
+
+def ingest_archive(owner, repo_name, token=None, incremental=False):
+    """
+        Index a repository straight from its zipball without extracting the tree to disk.
+        Members are parsed as they are read, at most MAX_PENDING_FILES are held in memory at once.
+    """
+    full_name = f"{owner}/{repo_name}"
+    stored_files, folder_ids = {}, {}
+
+    repos = client.query('getRepository', {'full_name': full_name})[0]['repo']
+    if repos:
+        stored_files, folder_ids = load_indexed_tree(full_name)
+        if not incremental:
+            # A full re-run re-parses every file, sync_file skips unchanged hashes otherwise
+            for stored in stored_files.values():
+                stored['reindex'] = True
+    else:
+        client.query('upsertRepository', {'username': owner, 'repo_name': repo_name, 'full_name': full_name})
+
+    pending = threading.BoundedSemaphore(MAX_PENDING_FILES)
+    def sync_member(rel_path, source_code):
+        try:
+            return sync_file(owner, repo_name, rel_path, source_code, stored_files.get(rel_path), folder_ids)
+        finally:
+            pending.release()
 
-    # Load gitignore specs at the start
-    gitignore_specs, root_dir = load_gitignore_specs(root_path)
+    current = set()
+    file_futures = []
+    for rel_path, source_code in iter_github_repo(owner, repo_name, token):
+        pending.acquire()
+        current.add(rel_path)
+        file_futures.append(executor.submit(sync_member, rel_path, source_code))
+        del source_code
 
-    root_id = client.query('createRepository', {'username': owner, 'repo_name': repo_name, 'full_name': f"{owner}/{repo_name}"})[0]['root'][0]['id']
-    populate(root_path, owner, repo_name, parent_id=root_id, gitignore_specs=gitignore_specs, root_dir=root_dir)
+    for future in file_futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error in file sync: {e}")
+
+    if stored_files:
+        delete_files([path for path in stored_files if path not in current], stored_files)
+        prune_folders(folder_ids, current)
 
 # Helper functions
-def populate(full_path: str, owner: str, repo_name: str, curr_type='root', parent_id=None, gitignore_specs=None, root_dir=None):
-    dir_dict = scan_directory(full_path, gitignore_specs, root_dir)
+def populate(full_path: str, owner: str, repo_name: str, curr_type='root', parent_id=None, matcher=None, root_dir=None):
+    dir_dict = scan_directory(full_path, matcher)
 
-    # Extract gitignore specs and root_dir if they were returned by scan_directory
-    gitignore_specs = dir_dict.get("gitignore_specs", gitignore_specs)
-    root_dir = dir_dict.get("root_dir", root_dir)
+    # Subfolders inherit this directory's matcher, including its own .gitignore
+    matcher = dir_dict["matcher"]
+    root_dir = root_dir or os.path.abspath(full_path)
 
     print(f'\nProcessing {len(dir_dict["folders"])} folders')
 
@@ -120,34 +313,27 @@ def populate(full_path: str, owner: str, repo_name: str, curr_type='root', paren
     # First create all folder entries
     for folder in dir_dict["folders"]:
         print(f"\nProcessing folder: {folder}")
-        if curr_type == 'root':
-            # Create super folder
-            folder_id = client.query('createSuperFolder', {'owner': owner, 'repo_name': repo_name, 'name': folder})[0]['folder'][0]['id']
-        else:
-            # Create sub folder
-            folder_id = client.query('createSubFolder', {'folder_id': parent_id, 'name': folder})[0]['subfolder'][0]['id']
+        folder_path = os.path.join(full_path, folder)
+        folder_id = create_folder(owner, repo_name, os.path.relpath(folder_path, root_dir), None if curr_type == 'root' else parent_id)
 
         # Submit folder processing to thread pool for parallel execution
         folder_futures.append(executor.submit(
             populate,
-            full_path,
+            folder_path,
             owner,
             repo_name,
             'folder',
             folder_id,
-            gitignore_specs,
+            matcher,
             root_dir
         ))
 
     # Process files in parallel
     print(f'\nProcessing {len(dir_dict["files"])} files')
 
-    # Filter out ignored files
-    files_to_process = [file for file in dir_dict["files"] if not is_ignored(os.path.join(full_path, file), gitignore_specs, root_dir)]
-
-    # Submit file processing tasks to the thread pool
+    # Submit file processing tasks to the thread pool, ignored files were already skipped by scan_directory
     file_futures = []
-    for file in files_to_process:
+    for file in dir_dict["files"]:
         print(f"\nSubmitting {file} for processing")
         file_futures.append(executor.submit(
             process_file,
@@ -156,7 +342,8 @@ def populate(full_path: str, owner: str, repo_name: str, curr_type='root', paren
             file,
             full_path,
             curr_type,
-            parent_id
+            parent_id,
+            root_dir
         ))
 
     # Wait for all file processing to complete
@@ -175,62 +362,21 @@ def populate(full_path: str, owner: str, repo_name: str, curr_type='root', paren
 
     del dir_dict
 
-def process_file(owner: str, repo_name: str, file: str, full_path: str, curr_type: str, parent_id: int):
+def process_file(owner: str, repo_name: str, file: str, full_path: str, curr_type: str, parent_id: int, root_dir: str):
     print(f"{file} is from {curr_type}")
-    parser = Parser()
     try:
         file_extension = file.split('.')[-1]
         if file_extension in LANGUAGE_CONFIG:
-            parser = Parser(LANGUAGE_CONFIG[file_extension])
-        elif file == '.gitignore':
-            parser = None
-
-        if parser is not None:
-            # Extract python code structure with tree-sitter
             file_path = os.path.join(full_path, file)
-            extension = file.split('.')[-1]
-            tree, code = parse_file(file_path, parser)
+            code = read_file(file_path)
 
-            if tree:
-                tree_dict = node_to_dict(tree.root_node, code, 0)
-                del tree
+            if code is not None:
+                rel_path = os.path.relpath(file_path, root_dir)
+                write_file(owner, repo_name, rel_path, code, None if curr_type == 'root' else parent_id)
                 del code
-
-                if curr_type == 'root':
-                    # Create super file
-                    file_id = client.query('createSuperFile', {'owner': owner, 'repo_name': repo_name, 'file_name': file, 'extension': extension, 'text': tree_dict['text']})[0]['file'][0]['id']
-                else:
-                    # Create sub file
-                    file_id = client.query('createFile', {'folder_id': parent_id, 'name': file, 'extension': extension, 'text': tree_dict['text']})[0]['file'][0]['id']
-
-                children = tree_dict['children']
-                del tree_dict
-
-                print(f"\nProcessing {len(children)} super entities in {file}")
-                for superentity in children:
-                    # Create super entity
-                    super_entity_id = client.query('createSuperEntity', {'file_id': file_id, 'entity_type': superentity['type'], 'start_byte': superentity['start_byte'], 'end_byte': superentity['end_byte'], 'order': superentity['order'], 'text': superentity['text']})[0]['entity'][0]['id']
-
-                    # Embed super entity
-                    chunks = chunk_entity(superentity['text'])
-                    for chunk in chunks:
-                        client.query('embedSuperEntity', {'entity_id':super_entity_id, 'vector': random_embedding(chunk)})
-                        del chunk
-
-                    del chunks
-
-                    process_entities(superentity, super_entity_id)
-
-                    del superentity
-
-                del children
                 return True
             else:
                 print(f'Failed to parse file: {file}')
-                if tree is not None:
-                    del tree
-                if code is not None:
-                    del code
                 return False
         else:
             print(f'Ignored: {file}')
@@ -239,247 +385,488 @@ def process_file(owner: str, repo_name: str, file: str, full_path: str, curr_typ
         print(f"Error processing file {file}: {e}")
         return False
 
-def process_entities(parent_dict, parent_id, step = 0):
-    if step < MAX_DEPTH and 'children' in parent_dict and len(parent_dict['children']) > 0:
-
-        children = parent_dict['children']
-        payload = [{'entity_id': parent_id, 'entity_type': entity['type'], 'start_byte': entity['start_byte'], 'end_byte': entity['end_byte'], 'order': entity['order'], 'text': entity['text']} for entity in children]
-
-        if len(payload) < 1:
-            return
-        entity_ids = [entity['entity'][0]['id'] for entity in client.query('createSubEntity', payload)]
-        del payload
-
-        for i in range(len(entity_ids)):
-            process_entities(children[i], entity_ids[i], step + 1)
+def write_super_entities(file_id, superentities):
+    """
+        Create the super entities of a file with their embeddings and sub entities.
+        Entities are per file, their embeddings are shared by every super entity with the same text.
+    """
+    # Create all super entities of the file in one request
+    super_entity_ids = create_entities('createSuperEntities', {'file_id': file_id}, superentities)
+    hashes = [entity_hash(superentity) for superentity in superentities]
+
+    # Identical entity texts written concurrently are embedded once, locks are taken in sorted order
+    # and kept apart from the whole-file content locks, which are held while these are acquired
+    with ExitStack() as stack:
+        for content_hash in sorted(set(hashes)):
+            stack.enter_context(content_lock(f'entity:{content_hash}'))
+
+        rows = [{'entity_id': super_entity_id, 'hash': content_hash} for super_entity_id, content_hash in zip(super_entity_ids, hashes)]
+        contents = client.query('linkEntityContents', {'file_id': file_id, 'entities': rows})[0]['contents'] if rows else []
+        embedded = {content['hash'] for content in contents if content['vectors']}
+
+        # Embed the chunks of every new text in the file together, so the embedder can batch them
+        unembedded = {}
+        for superentity, content_hash in zip(superentities, hashes):
+            if content_hash not in embedded:
+                unembedded.setdefault(content_hash, superentity)
+        chunk_counts = []
+        chunks = []
+        for content_hash, superentity in unembedded.items():
+            entity_chunks = chunk_entity(superentity, embedder.count_tokens, embedder.max_tokens, CHUNK_OVERLAP_TOKENS)
+            chunk_counts.append((content_hash, len(entity_chunks)))
+            chunks.extend(entity_chunks)
+
+        # Vectors are written to HelixDB in bulk, all of them before the file is marked complete
+        vectors = iter(embedder.embed(chunks))
+        batcher = EmbeddingBatcher()
+        for content_hash, count in chunk_counts:
+            batcher.add(content_hash, [next(vectors) for _ in range(count)])
+        batcher.flush()
+
+    if superentities:
+        print(f"Embedded {len(unembedded)} and shared {len(set(hashes)) - len(unembedded)} super entity texts")
+
+    del chunks
+    del chunk_counts
+
+    write_sub_entities(file_id, list(zip(superentities, super_entity_ids)))
+
+    del super_entity_ids
+
+def write_sub_entities(file_id, parents):
+    """
+        Create the sub entities of (entity, entity_id) pairs of a file, down to MAX_DEPTH.
+        Each depth level is written with one bulk request whose rows carry their parent id.
+    """
+    level = parents
+    for _ in range(MAX_DEPTH):
+        rows = [(child, parent_id) for parent, parent_id in level for child in parent.children]
+        if not rows:
+            break
+        level = create_sub_entities(file_id, rows)
+
+def create_sub_entities(file_id, rows):
+    """Create (entity, parent_id) rows in one request, returning (entity, new_id) pairs in the same order."""
+    # Sub entities are stored without text, it is only read for super entities and would only crowd BM25
+    payload = {'file_id': file_id, 'entities': [{'parent_id': parent_id, **entity_row(entity, with_text=False)} for entity, parent_id in rows]}
+    result = client.query('createSubEntities', payload)[0]
+    del payload
+
+    # Siblings have a unique order, so (parent, order) maps the created nodes back to their input
+    ids = {}
+    for created in result['created'] + result['nested']:
+        parent = created['parent']
+        parent_id = (parent[0] if isinstance(parent, list) else parent)['id']
+        ids[(parent_id, created['order'])] = created['id']
+    return [(entity, ids[(parent_id, entity.order)]) for entity, parent_id in rows]
+
+def create_entities(query_name, params, entities):
+    """
+        Create a list of sibling entities with a single bulk query.
+        Returns the new entity ids in the same order as `entities`.
+    """
+    if not entities:
+        return []
 
-        del children
-        del entity_ids
+    payload = dict(params)
+    payload['entities'] = [entity_row(entity) for entity in entities]
 
-def parse_file(file_path, parser):
-    try:
-        with open(file_path, 'rb') as file:
-            source_code = file.read()
+    # Siblings have a unique order, so use it to map the created nodes back to their input
+    created = client.query(query_name, payload)[0]['created']
+    ids_by_order = {entity['order']: entity['id'] for entity in created}
+    del payload
 
-        # Calculate file hash to avoid re-parsing identical files
-        file_hash = hashlib.sha1(source_code).hexdigest()
-        if file_hash in seen_files:
-            print(f"Ignored duplicate: {file_path}")
-            return None, None
+    return [ids_by_order[entity.order] for entity in entities]
 
-        seen_files.add(file_hash)
-        return parser.parse(source_code), source_code
-    except Exception as e:
-        print(f"Error parsing {file_path}: {e}")
-        return None, None
-
-def node_to_dict(node, source_code, order:int=1):
-    return {
-        "type": node.type,
-        "start_byte": node.start_byte,
-        "end_byte": node.end_byte,
-        "order": order,
-        "text": source_code[node.start_byte:node.end_byte].decode('utf8'),
-        "children": [node_to_dict(child, source_code, i+1) for i, child in enumerate(node.children)]
-    }
-
-# Cache for PathSpec objects to avoid rebuilding them
-_spec_cache = {}
-
-def get_spec(patterns):
-    """Get a cached PathSpec object for the given patterns."""
-    if not patterns:
-        return None
+def entity_row(entity, with_text=True):
+    return {'entity_type': entity.type, 'start_byte': entity.start_byte, 'end_byte': entity.end_byte, 'order': entity.order, 'text': stored_text(entity.text) if with_text else '', 'content_hash': entity_hash(entity)}
 
-    # Create a hash key from the patterns
-    key = hashlib.sha1("\n".join(patterns).encode()).hexdigest()
+def entity_hash(entity):
+    return hashlib.sha1(entity.source.view[entity.start_byte:entity.end_byte]).hexdigest()
 
-    # Return cached spec if available
-    if key not in _spec_cache:
-        _spec_cache[key] = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+def create_folder(owner: str, repo_name: str, rel_path: str, parent_id=None):
+    """Create a folder node, directly under the repository when parent_id is None."""
+    name = os.path.basename(rel_path)
+    repo = f"{owner}/{repo_name}"
+    if parent_id is None:
+        # Create super folder
+        return client.query('upsertSuperFolder', {'folder_name': name, 'repo': repo, 'path': rel_path, 'repo_path': f"{repo}/{rel_path}"})[0]['folder'][0]['id']
+    # Create sub folder
+    return client.query('upsertSubFolder', {'folder_id': parent_id, 'name': name, 'repo': repo, 'path': rel_path, 'repo_path': f"{repo}/{rel_path}"})[0]['subfolder'][0]['id']
 
-    return _spec_cache[key]
+def create_file(owner: str, repo_name: str, rel_path: str, parent_id=None):
+    """
+        Create a file node, directly under the repository when parent_id is None.
+        Its text and content hash are only set by update_file once its entities are written.
+    """
+    name = os.path.basename(rel_path)
+    extension = name.split('.')[-1]
+    repo = f"{owner}/{repo_name}"
+    if parent_id is None:
+        # Create super file
+        return client.query('upsertSuperFile', {'file_name': name, 'extension': extension, 'text': '', 'repo': repo, 'path': rel_path, 'repo_path': f"{repo}/{rel_path}", 'content_hash': ''})[0]['file'][0]['id']
+    # Create sub file
+    return client.query('upsertFile', {'folder_id': parent_id, 'name': name, 'extension': extension, 'text': '', 'repo': repo, 'path': rel_path, 'repo_path': f"{repo}/{rel_path}", 'content_hash': ''})[0]['file'][0]['id']
+
+def update_file(file_id, text: str, content_hash: str):
+    client.query('updateFile', {'file_id': file_id, 'text': stored_text(text), 'content_hash': content_hash})
+    store_blob(file_id, content_hash, text)
+
+def write_file(owner: str, repo_name: str, rel_path: str, source_code: bytes, parent_id=None, stored=None):
+    """
+        Create a file node with its entities, or update the indexed file `stored`.
+        Contents already indexed at any path of any repository are not parsed or embedded again,
+        the file links the entities (and through them the embeddings) of that copy.
 
-def get_spec_for_path(path, gitignore_specs):
-    """Get or create a PathSpec for a specific directory path."""
-    # Use absolute path as the key
-    abs_path = os.path.abspath(path) if not os.path.isabs(path) else path
+        A file only becomes linkable once its entities are fully written, its content hash and Blob
+        are set as the last step, under the lock of that hash. A write interrupted before then leaves
+        the file without a content hash, so the next sync redoes it.
+    """
+    content_hash = hashlib.sha1(source_code).hexdigest()
+    file_id = stored['id'] if stored else None
+
+    shared = False
+    if stored:
+        with content_lock(stored['content_hash']):
+            shared = len(indexed_copies(stored['content_hash'])) > 1
+            # Detach from the old contents first, so no identical file links entities that are about to change
+            client.query('unlinkFileHash', {'file_id': file_id})
+
+    with content_lock(content_hash):
+        copies = [copy_id for copy_id in indexed_copies(content_hash) if copy_id != file_id]
+        if copies:
+            text = source_code.decode('utf8', errors='replace')
+            root = None
+        else:
+            # Parse in the process pool, this thread only does the HelixDB writes
+            root = get_parse_pool().submit(parse_source, rel_path, source_code).result()
+            root.source.bind(source_code)
+            text = root.text
+
+        if stored and not copies and not shared and stored['content_hash']:
+            print(f"Updating changed file: {rel_path}")
+            update_super_entities(file_id, root.children)
+        else:
+            if stored:
+                # Entities shared with identical files are never modified in place, and a half written file is redone
+                print(f"Replacing the entities of changed file: {rel_path}")
+                client.query('unlinkFileEntities', {'file_id': file_id})
+            else:
+                file_id = create_file(owner, repo_name, rel_path, parent_id)
 
-    # Return cached spec if available
-    if abs_path in spec_map:
-        return spec_map[abs_path]
+            if copies:
+                entity_ids = [entity['id'] for entity in client.query('getFileEntities', {'file_id': copies[0]})[0]['entities']]
+                client.query('linkFileEntities', {'file_id': file_id, 'entity_ids': entity_ids})
+                print(f"Linked {len(entity_ids)} super entities of an identical indexed file to {rel_path}")
+            else:
+                print(f"\nProcessing {len(root.children)} super entities in {rel_path}")
+                write_super_entities(file_id, root.children)
+
+        del root
+        update_file(file_id, text, content_hash)
+    return file_id
+
+def indexed_copies(content_hash: str):
+    """Ids of the fully written files with the given contents, in any repository."""
+    if not content_hash:
+        return []
+    return [file['id'] for file in client.query('getFilesByHash', {'content_hash': content_hash})[0]['files']]
+
+@contextmanager
+def content_lock(content_hash: str):
+    """Serialise the writes of identical contents, the lock is dropped once no thread holds or waits for it."""
+    with content_locks_lock:
+        entry = content_locks.setdefault(content_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with content_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del content_locks[content_hash]
+
+def stored_text(text: str) -> str:
+    """Text written to a File or Entity node, empty in blob mode where it is read from the file's Blob."""
+    return '' if TEXT_STORAGE == 'blob' else text
+
+def store_blob(file_id, content_hash: str, text: str):
+    """Point a file at the blob of its contents, the blob is shared by every file with the same hash."""
+    if TEXT_STORAGE == 'blob':
+        client.query('linkFileBlob', {'file_id': file_id, 'content_hash': content_hash, 'text': text})
+    else:
+        client.query('linkFileHash', {'file_id': file_id, 'content_hash': content_hash})
 
-    # Check for a .gitignore file in the current directory
-    local_gitignore = os.path.join(abs_path, '.gitignore')
+# Incremental update functions
+def update_repository(root_path: str, owner: str, repo_name: str, matcher, root_dir):
+    """
+        Sync an already indexed repository with a freshly downloaded tree.
+        Files are diffed on their content hash, only new or changed files are re-parsed and
+        re-embedded, and files or folders that vanished from the tree are deleted.
+    """
+    stored_files, folder_ids = load_indexed_tree(f"{owner}/{repo_name}")
 
-    # Start with a copy of the existing specs
-    path_specs = dict(gitignore_specs) if gitignore_specs else {}
+    current_files = collect_files(root_path, matcher, root_dir)
+    print(f"\nSyncing {len(current_files)} files against {len(stored_files)} indexed files")
 
-    # Add the local .gitignore if it exists and hasn't been processed
-    if os.path.isfile(local_gitignore) and abs_path not in path_specs:
+    file_futures = [
+        executor.submit(sync_local_file, owner, repo_name, rel_path, root_dir, stored_files.get(rel_path), folder_ids)
+        for rel_path in current_files
+    ]
+    for future in file_futures:
         try:
-            with open(local_gitignore, 'r') as f:
-                patterns = f.read().splitlines()
-                # Filter out empty lines and comments
-                patterns = [p for p in patterns if p and not p.startswith('#')]
-                if patterns:
-                    path_specs[abs_path] = get_spec(patterns)
+            future.result()
         except Exception as e:
-            print(f"Error reading {local_gitignore}: {e}")
+            print(f"Error in file sync: {e}")
 
-    # Cache the result
-    spec_map[abs_path] = path_specs
+    # Delete files that are no longer in the tree
+    current = set(current_files)
+    delete_files([path for path in stored_files if path not in current], stored_files)
+    prune_folders(folder_ids, current)
 
-    return path_specs
-
-def load_gitignore_specs(root_path):
-    """Load gitignore specs from all .gitignore files in the given path and its parent directories."""
-    specs = {}
-    pattern_lists = {}
+def update_paths(owner: str, repo_name: str, changed_paths, removed_paths, token=None, ref="main"):
+    """
+        Sync only the given paths of an already indexed repository, e.g. the files touched by a push.
+        Changed files are fetched one by one from GitHub instead of downloading the whole repository.
+        Returns False if the repository has not been indexed yet.
+    """
+    repos = client.query('getRepository', {'full_name': f"{owner}/{repo_name}"})[0]['repo']
+    if not repos:
+        print(f"{owner}/{repo_name} has not been indexed yet, skipping update")
+        return False
 
-    # Ensure we're working with absolute paths
-    root_path = os.path.abspath(root_path)
+    if any(os.path.basename(path) == '.gitignore' for path in (*changed_paths, *removed_paths)):
+        # Files the push didn't touch may have become ignored or indexable, re-check the whole repository
+        print(f"Push changed .gitignore rules of {owner}/{repo_name}, syncing the whole repository")
+        ingest_archive(owner, repo_name, token, incremental=True)
+        return True
+
+    stored_files, folder_ids = load_indexed_tree(f"{owner}/{repo_name}")
+    # Ignore rules of the pushed tree, each directory's .gitignore is fetched once
+    rules = RepoIgnoreRules(DEFAULT_IGNORE_PATTERNS, lambda rel_dir: fetch_gitignore(owner, repo_name, rel_dir, token, ref))
+    changed_paths = [path for path in changed_paths if path.split('.')[-1] in LANGUAGE_CONFIG and not rules.is_ignored(path)]
+    print(f"\nSyncing {len(changed_paths)} changed and {len(removed_paths)} removed files")
+
+    file_futures = [
+        executor.submit(sync_remote_file, owner, repo_name, rel_path, token, ref, stored_files.get(rel_path), folder_ids)
+        for rel_path in changed_paths
+    ]
+    for future in file_futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error in file sync: {e}")
+
+    removed = [path for path in removed_paths if path in stored_files]
+    delete_files(removed, stored_files)
+    prune_folders(folder_ids, (set(stored_files) - set(removed)) | set(changed_paths))
+    return True
+
+def load_indexed_tree(full_name: str):
+    """Return the indexed files (path -> node) and folder ids (path -> id) of a repository."""
+    stored_files = {file['path']: file for file in client.query('getRepositoryFiles', {'repo': full_name})[0]['files']}
+    folder_ids = {folder['path']: folder['id'] for folder in client.query('getRepositoryFolders', {'repo': full_name})[0]['folders']}
+    return stored_files, folder_ids
+
+def delete_files(paths, stored_files: dict):
+    for path in paths:
+        print(f"Deleting vanished file: {path}")
+        client.query('deleteFile', {'file_id': stored_files[path]['id']})
+
+def prune_folders(folder_ids: dict, file_paths):
+    """Delete folders that no longer contain any indexed file, deepest first."""
+    live_folders = set()
+    for path in file_paths:
+        parent = os.path.dirname(path)
+        while parent and parent not in live_folders:
+            live_folders.add(parent)
+            parent = os.path.dirname(parent)
+
+    for path in sorted(folder_ids, key=len, reverse=True):
+        if path not in live_folders:
+            print(f"Deleting vanished folder: {path}")
+            client.query('deleteFolder', {'folder_id': folder_ids.pop(path)})
+
+def collect_files(root_path: str, matcher, root_dir):
+    """Walk the tree like populate does and return the relative paths of every parseable file."""
+    paths = []
+    pending = [(root_path, matcher)]
+    while pending:
+        current_path, matcher = pending.pop()
+        dir_dict = scan_directory(current_path, matcher)
+
+        for folder in dir_dict["folders"]:
+            pending.append((os.path.join(current_path, folder), dir_dict["matcher"]))
+        for file in dir_dict["files"]:
+            if file.split('.')[-1] in LANGUAGE_CONFIG:
+                paths.append(os.path.relpath(os.path.join(current_path, file), root_dir))
+
+    return paths
+
+def ensure_folder(owner: str, repo_name: str, rel_path: str, folder_ids: dict):
+    """Return the id of the folder at rel_path, creating it and any missing parents. Call with folder_lock held."""
+    if rel_path in folder_ids:
+        return folder_ids[rel_path]
+
+    parent_path = os.path.dirname(rel_path)
+    parent_id = ensure_folder(owner, repo_name, parent_path, folder_ids) if parent_path else None
+    folder_ids[rel_path] = create_folder(owner, repo_name, rel_path, parent_id)
+    return folder_ids[rel_path]
+
+def sync_local_file(owner: str, repo_name: str, rel_path: str, root_dir: str, stored, folder_ids: dict):
+    try:
+        with open(os.path.join(root_dir, rel_path), 'rb') as file:
+            source_code = file.read()
+    except Exception as e:
+        print(f"Error reading file {rel_path}: {e}")
+        return False
+    return sync_file(owner, repo_name, rel_path, source_code, stored, folder_ids)
 
-    # Start with the root path and go up to find all parent .gitignore files
-    current_path = root_path
-    root_dir = os.path.dirname(current_path) if os.path.isfile(current_path) else current_path
-
-    # Add default patterns to always ignore (like .git/)
-    if DEFAULT_IGNORE_PATTERNS:
-        # Use a special key for default patterns
-        default_key = "DEFAULT"
-        specs[default_key] = get_spec(DEFAULT_IGNORE_PATTERNS)
-        pattern_lists[default_key] = DEFAULT_IGNORE_PATTERNS
-
-    # Get all parent .gitignore files up to the filesystem root
-    while current_path:
-        gitignore_path = os.path.join(current_path, '.gitignore')
-
-        # Check if file exists before trying to read it
-        if os.path.isfile(gitignore_path):
-            try:
-                with open(gitignore_path, 'r') as f:
-                    patterns = f.read().splitlines()
-                    # Filter out empty lines and comments
-                    patterns = [p for p in patterns if p and not p.startswith('#')]
-                    if patterns:
-                        print(f"Found .gitignore at {current_path}")
-                        pattern_lists[current_path] = patterns
-                        specs[current_path] = get_spec(patterns)
-            except Exception as e:
-                print(f"Error reading {gitignore_path}: {e}")
-
-        # Move up one directory
-        parent_path = os.path.dirname(current_path)
-        if parent_path == current_path:  # Reached the filesystem root
-            break
-        current_path = parent_path
+def sync_remote_file(owner: str, repo_name: str, rel_path: str, token, ref: str, stored, folder_ids: dict):
+    try:
+        source_code = fetch_github_file(owner, repo_name, rel_path, token, ref)
+    except Exception as e:
+        print(f"Error fetching file {rel_path}: {e}")
+        return False
+    return sync_file(owner, repo_name, rel_path, source_code, stored, folder_ids)
 
-    return specs, root_dir
+def sync_file(owner: str, repo_name: str, rel_path: str, source_code: bytes, stored, folder_ids: dict):
+    """Create or update a single file if its content hash differs from the indexed one."""
+    try:
+        content_hash = hashlib.sha1(source_code).hexdigest()
+        if stored and stored['content_hash'] == content_hash and not stored.get('reindex'):
+            return False
 
-def is_ignored(path, gitignore_specs, root_dir):
-    """Check if a path is ignored by any gitignore spec."""
-    if not gitignore_specs:
+        if stored:
+            write_file(owner, repo_name, rel_path, source_code, stored=stored)
+        else:
+            print(f"Adding new file: {rel_path}")
+            folder_path = os.path.dirname(rel_path)
+            parent_id = None
+            if folder_path:
+                with folder_lock:
+                    parent_id = ensure_folder(owner, repo_name, folder_path, folder_ids)
+            write_file(owner, repo_name, rel_path, source_code, parent_id)
+
+        del source_code
+        return True
+    except Exception as e:
+        print(f"Error syncing file {rel_path}: {e}")
         return False
 
-    # Use the provided path without resolving again if it's already absolute
-    if os.path.isabs(path):
-        abs_path = path
-    else:
-        abs_path = os.path.abspath(path)
+def update_super_entities(file_id, superentities):
+    """
+        Diff the super entities of a changed file against the indexed ones by content hash.
+        Unchanged entities keep their node and embeddings, only their position is updated,
+        stale entities are deleted and new ones are created and embedded.
+    """
+    stored_by_hash = {}
+    for stored in client.query('getFileEntities', {'file_id': file_id})[0]['entities']:
+        stored_by_hash.setdefault(stored['content_hash'], []).append(stored)
+
+    kept = []
+    created = []
+    for superentity in superentities:
+        matches = stored_by_hash.get(entity_hash(superentity))
+        if matches:
+            kept.append((superentity, matches.pop()))
+        else:
+            created.append(superentity)
 
-    # For debugging and pattern matching
-    basename = os.path.basename(abs_path)
+    stale_ids = [stored['id'] for matches in stored_by_hash.values() for stored in matches]
+    if stale_ids:
+        client.query('deleteEntities', {'entity_ids': stale_ids})
 
-    # Special case for default patterns (always check first)
-    if "DEFAULT" in gitignore_specs:
-        # Get the relative path from the root directory
-        rel_path = os.path.relpath(abs_path, root_dir)
+    moved = [(superentity, stored) for superentity, stored in kept if superentity.start_byte != stored['start_byte'] or superentity.order != stored['order']]
+    if moved:
+        client.query('updateEntityPositions', {'entities': [{'entity_id': stored['id'], 'start_byte': superentity.start_byte, 'end_byte': superentity.end_byte, 'order': superentity.order} for superentity, stored in moved]})
 
-        # Check if the path matches any default pattern
-        if gitignore_specs["DEFAULT"].match_file(rel_path) or gitignore_specs["DEFAULT"].match_file(basename):
-            # print(f"Ignoring {abs_path} due to default ignore pattern")
-            return True
+        # Sub entities store absolute offsets, so rebuild them when their parent shifted
+        shifted = [(superentity, stored) for superentity, stored in moved if superentity.start_byte != stored['start_byte']]
+        if shifted:
+            client.query('deleteSubEntities', {'entity_ids': [stored['id'] for _, stored in shifted]})
+            write_sub_entities(file_id, [(superentity, stored['id']) for superentity, stored in shifted])
 
-    # Check each spec, starting from the most specific (closest to the file)
-    for dir_path, spec in sorted(gitignore_specs.items(), key=lambda x: len(x[0]) if x[0] != "DEFAULT" else 0, reverse=True):
-        # Skip the default patterns as we've already checked them
-        if dir_path == "DEFAULT":
-            continue
+    print(f"Kept {len(kept)}, deleted {len(stale_ids)} and created {len(created)} super entities")
+    write_super_entities(file_id, created)
 
-        try:
-            # Skip unnecessary path resolution - just use the paths directly for comparison
-            # Only apply specs from directories that are parents of the path
-            try:
-                # For directory paths, ensure they're absolute for comparison
-                if os.path.isabs(dir_path):
-                    abs_dir_path = dir_path
-                else:
-                    abs_dir_path = os.path.abspath(dir_path)
-
-                if os.path.commonpath([abs_dir_path, abs_path]) == abs_dir_path:
-                    # Get the relative path from the gitignore directory - no need to resolve again
-                    rel_path = os.path.relpath(abs_path, abs_dir_path)
-
-                    # Check if the path matches any pattern in the spec
-                    if spec.match_file(rel_path):
-                        # print(f"Ignoring {abs_path} due to pattern in {dir_path}/.gitignore")
-                        return True
-
-                    # Also check just the basename for directory patterns like "test_folder/"
-                    if basename and spec.match_file(basename):
-                        # print(f"Ignoring {abs_path} due to basename match in {dir_path}/.gitignore")
-                        return True
-
-                    # Special handling for directory patterns like "test_folder/"
-                    if os.path.isdir(abs_path):
-                        # Try with trailing slash
-                        dir_pattern = f"{basename}/"
-                        if spec.match_file(dir_pattern):
-                            # print(f"Ignoring directory {abs_path} due to pattern {dir_pattern} in {dir_path}/.gitignore")
-                            return True
-            except ValueError:
-                # Skip if paths can't be compared (different drives, etc.)
-                continue
-        except Exception as e:
-            print(f"Error checking if {path} is ignored: {e}")
-            continue
+def read_file(file_path):
+    try:
+        with open(file_path, 'rb') as file:
+            source_code = file.read()
+        return source_code
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
 
-    return False
+def read_gitignore(dir_path):
+    gitignore_path = os.path.join(dir_path, '.gitignore')
+    try:
+        with open(gitignore_path, 'r') as f:
+            return f.read().splitlines()
+    except Exception as e:
+        print(f"Error reading {gitignore_path}: {e}")
+        return []
 
-def scan_directory(root_path, gitignore_specs=None, root_dir=None):
-    """Scan a directory and return folders and files, respecting gitignore rules."""
-    folders = []
-    files = []
+def load_ignore_matcher(root_path):
+    """
+        Build the matcher for root_path from DEFAULT_IGNORE_PATTERNS and the .gitignore files of its
+        parent directories. root_path's own .gitignore is added by scan_directory.
+    """
+    root_path = os.path.abspath(root_path)
 
+    # Collect parent directories up to the filesystem root
+    parents = []
+    current_path = root_path
+    while os.path.dirname(current_path) != current_path:
+        current_path = os.path.dirname(current_path)
+        parents.append(current_path)
+
+    # Chain the matchers from the filesystem root down
+    matcher = None
+    for dir_path in reversed(parents):
+        if os.path.isfile(os.path.join(dir_path, '.gitignore')):
+            print(f"Found .gitignore at {dir_path}")
+            rules = compile_ignore_rules(read_gitignore(dir_path))
+            if rules:
+                matcher = IgnoreMatcher(dir_path, rules, matcher)
+
+    return IgnoreMatcher(root_path, compile_ignore_rules(DEFAULT_IGNORE_PATTERNS), matcher)
+
+def scan_directory(root_path, matcher=None):
+    """Scan a directory and return folders and files, respecting gitignore rules."""
     # Ensure root_path is absolute
     root_path = os.path.abspath(root_path)
 
-    # Initialize gitignore specs if not provided
-    if gitignore_specs is None:
-        gitignore_specs, root_dir = load_gitignore_specs(root_path)
+    # Initialize the matcher if not provided
+    if matcher is None:
+        matcher = load_ignore_matcher(root_path)
 
-    # Check if the directory itself is ignored
-    if is_ignored(root_path, gitignore_specs, root_dir):
-        print(f"Ignored: {root_path}")
-        return {"folders": [], "files": []}
+    with os.scandir(root_path) as iterator:
+        entries = list(iterator)
 
-    # Get or update gitignore specs for this path
-    gitignore_specs = get_spec_for_path(root_path, gitignore_specs)
+    # Add this directory's .gitignore, the listing already tells us whether it exists
+    if any(entry.name == '.gitignore' for entry in entries):
+        matcher = matcher.for_directory(root_path, read_gitignore(root_path))
+
+    folders = []
+    files = []
+    for entry in entries:
+        # DirEntry caches the file type from the directory listing, so this doesn't stat again
+        is_dir = entry.is_dir()
 
-    # Scan directory
-    for entry in os.scandir(root_path):
         # Skip ignored files and folders
-        if is_ignored(entry.path, gitignore_specs, root_dir):
+        if matcher.is_ignored(entry.path, is_dir):
             print(f"Ignored: {entry.name}")
             continue
 
-        if entry.is_dir():
+        if is_dir:
             folders.append(entry.name)
         else:
             files.append(entry.name)
 
-    return {"folders": folders, "files": files, "gitignore_specs": gitignore_specs, "root_dir": root_dir}
+    return {"folders": folders, "files": files, "matcher": matcher}
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser(description="HelixDB Codebase Ingestion")
@@ -487,5 +874,9 @@ if __name__ == "__main__":
     args = argparser.parse_args()
     print(f"Scanning Codebase at: {args.root}\n")
     start_time = time.time()
+
+    # HelixDB Instance
+    instance = Instance()
+    time.sleep(1)
     print(f"\nInstance ID: {instance.instance_id}")
     print(f"Time taken: {time.time() - start_time}")
@@ -13,7 +13,9 @@ Language.build_library(
     'vendor/tree-sitter-zig',
     'vendor/tree-sitter-cpp',
     'vendor/tree-sitter-c',
-    'vendor/tree-sitter-typescript',
+    # The typescript repository holds two grammars, typescript and tsx
+    'vendor/tree-sitter-typescript/typescript',
+    'vendor/tree-sitter-typescript/tsx',
   ]
 )
 
@@ -0,0 +1,71 @@
+"""
+Parse stage of the indexer, tree-sitter parsing and entity building.
+
+Runs in the indexer's worker processes, so importing it has no side effects beyond loading
+the grammars: no HelixDB client, embedder or pools.
+"""
+
+from tree_sitter import Parser
+try:
+    from .language_config import LANGUAGE_CONFIG
+except ImportError:
+    from language_config import LANGUAGE_CONFIG
+
+# Maximum depth of sub entities to process
+MAX_DEPTH = 2
+
+class SourceBuffer:
+    """
+        Shared read-only view of a file's bytes. Entity records slice their text out of it on demand,
+        so a file's text is held once instead of once per entity. Never pickled with its bytes, the
+        parse stage returns records with an empty buffer and the I/O stage binds the source it read.
+    """
+    __slots__ = ('view',)
+
+    def __init__(self):
+        self.view = None
+
+    def __reduce__(self):
+        return (SourceBuffer, ())
+
+    def bind(self, source_code: bytes):
+        self.view = memoryview(source_code)
+
+    def text(self, start_byte: int, end_byte: int) -> str:
+        return bytes(self.view[start_byte:end_byte]).decode('utf8')
+
+class EntityRecord:
+    """Compact tree-sitter entity, byte offsets into a shared SourceBuffer instead of a copy of its text."""
+    __slots__ = ('type', 'start_byte', 'end_byte', 'order', 'children', 'source')
+
+    def __init__(self, type: str, start_byte: int, end_byte: int, order: int, children: list, source: SourceBuffer):
+        self.type = type
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+        self.order = order
+        self.children = children
+        self.source = source
+
+    @property
+    def text(self) -> str:
+        """Decoded lazily, only when the entity is sent to HelixDB."""
+        return self.source.text(self.start_byte, self.end_byte)
+
+def parse_source(file_name, source_code):
+    """
+        Parse stage, runs in the process pool so tree building isn't serialised by the GIL.
+        Returns the root EntityRecord of the file, its children are the super entities.
+        Call root.source.bind(source_code) before reading any text.
+    """
+    parser = Parser(LANGUAGE_CONFIG[file_name.split('.')[-1]])
+    tree = parser.parse(source_code)
+    root = build_entity(tree.root_node, SourceBuffer(), 0, -1)
+    del tree
+    return root
+
+def build_entity(node, source, order:int=1, step:int=0):
+    """Build entity records, stopping at the MAX_DEPTH levels write_sub_entities writes."""
+    children = []
+    if step < MAX_DEPTH:
+        children = [build_entity(child, source, i+1, step + 1) for i, child in enumerate(node.children)]
+    return EntityRecord(node.type, node.start_byte, node.end_byte, order, children, source)
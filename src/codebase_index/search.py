@@ -0,0 +1,133 @@
+"""
+Code search over the indexed repositories.
+
+`search_code` runs a vector top-k over EmbeddedCode, `hybrid_search_code` also
+runs BM25 over Entity.text in the same round-trip and fuses both rankings with
+reciprocal rank fusion. Results are scoped to a single repository and carry the
+path of the file each entity belongs to.
+
+When the index is built in blob mode (HELIX_TEXT_STORAGE=blob) nodes don't keep
+their text, `file_text` and `entity_text` materialise it from the file's Blob.
+"""
+
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    from .ingestion import client, embedder
+except ImportError:
+    from ingestion import client, embedder
+
+# The repository filter runs after the HNSW / BM25 top-k over every indexed repository
+# (embeddings are shared by identical files across repositories, so the vector search can't
+# be pre-filtered by repository). Searches fetch k * SEARCH_OVERSAMPLE candidates, and are
+# retried at most once, with the top-k scaled by the share of candidates the filter kept
+# (times SEARCH_RETRY_MARGIN), up to SEARCH_MAX_K
+SEARCH_OVERSAMPLE = 4
+SEARCH_RETRY_MARGIN = 2
+SEARCH_MAX_K = 4096
+# Standard RRF constant, dampens the weight of the top few ranks
+RRF_K = 60
+# Blobs kept in memory, a blob never changes once written so entries never go stale
+BLOB_CACHE_SIZE = 256
+
+
+def search_code(owner: str, repo_name: str, query: str, k: int = 10) -> List[Dict]:
+    """Return the k entities of owner/repo_name closest to the query embedding."""
+    repo = f"{owner}/{repo_name}"
+    result = scoped_search('searchCode', {'repo': repo, 'vector': embedder.embed_one(query)}, k)
+    hits = unique_hits(result.get('vector_hits', []))
+    return [to_result(hit, 1.0 / (RRF_K + rank), repo) for rank, hit in enumerate(hits[:k], 1)]
+
+
+def hybrid_search_code(owner: str, repo_name: str, query: str, k: int = 10) -> List[Dict]:
+    """Return the top k entities of owner/repo_name by vector and BM25 rank, fused with RRF."""
+    repo = f"{owner}/{repo_name}"
+    result = scoped_search('hybridSearchCode', {'repo': repo, 'query': query, 'vector': embedder.embed_one(query)}, k)
+
+    scores = {}
+    entities = {}
+    for ranking in (result.get('vector_hits', []), result.get('bm25_hits', [])):
+        for rank, hit in enumerate(unique_hits(ranking), 1):
+            scores[hit['id']] = scores.get(hit['id'], 0.0) + 1.0 / (RRF_K + rank)
+            entities.setdefault(hit['id'], hit)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [to_result(entities[entity_id], scores[entity_id], repo) for entity_id in ranked]
+
+
+def scoped_search(query_name: str, params: Dict, k: int) -> Dict:
+    """
+    Run a repository scoped search, at most two round-trips. A round whose vector and BM25 hits together
+    keep fewer than k entities is retried once with a wider top-k, unless the index had no more candidates.
+    """
+    fetch = k * SEARCH_OVERSAMPLE
+    result = client.query(query_name, {**params, 'k': fetch})[0]
+    found = len(fused_ids(result))
+    counts = candidate_counts(result)
+    exhausted = bool(counts) and all(count < fetch for count in counts)
+    if found >= k or exhausted or fetch >= SEARCH_MAX_K:
+        return result
+
+    retry = min(fetch * k // max(found, 1) * SEARCH_RETRY_MARGIN, SEARCH_MAX_K)
+    return client.query(query_name, {**params, 'k': retry})[0]
+
+
+def fused_ids(result: Dict) -> set:
+    """Distinct entities among a search's vector and BM25 hits"""
+    return {hit['id'] for ranking in ('vector_hits', 'bm25_hits') for hit in result.get(ranking, [])}
+
+
+def candidate_counts(result: Dict) -> List[int]:
+    """Global candidates of each ranking before the repository filter"""
+    return [result[name] for name in ('vector_count', 'bm25_count') if name in result]
+
+
+def unique_hits(hits: List[Dict]) -> List[Dict]:
+    """Drop repeated entities, an entity split into several chunks can match more than once."""
+    seen = set()
+    unique = []
+    for hit in hits:
+        if hit['id'] not in seen:
+            seen.add(hit['id'])
+            unique.append(hit)
+    return unique
+
+
+def to_result(hit: Dict, score: float, repo: str) -> Dict:
+    file = hit.get('file') or {}
+    if isinstance(file, list):
+        # Entities are shared by identical files across repositories, report the copy in this one
+        file = next((candidate for candidate in file if candidate.get('repo') == repo), file[0] if file else {})
+    return {
+        'entity_id': hit['id'],
+        'entity_type': hit.get('entity_type'),
+        'repo': file.get('repo'),
+        'path': file.get('path'),
+        'file_id': file.get('id'),
+        'start_byte': hit.get('start_byte'),
+        'end_byte': hit.get('end_byte'),
+        'text': entity_text(hit, file),
+        'score': score,
+    }
+
+
+@lru_cache(maxsize=BLOB_CACHE_SIZE)
+def blob_source(content_hash: str) -> bytes:
+    """Contents of a file from the blob store, by content hash."""
+    blobs = client.query('getBlob', {'content_hash': content_hash})[0]['blob']
+    return blobs[0]['text'].encode('utf8') if blobs else b''
+
+
+def file_text(file: Dict) -> str:
+    """Text of a File node, read from the blob store when the node doesn't keep it."""
+    if file.get('text') or not file.get('content_hash'):
+        return file.get('text') or ''
+    return blob_source(file['content_hash']).decode('utf8')
+
+
+def entity_text(entity: Dict, file: Dict) -> str:
+    """Text of an Entity node, sliced from its file's blob by byte offsets when the node doesn't keep it."""
+    if entity.get('text') or not file.get('content_hash'):
+        return entity.get('text') or ''
+    return blob_source(file['content_hash'])[entity['start_byte']:entity['end_byte']].decode('utf8', errors='replace')
@@ -1,11 +1,78 @@
 import os
 import time
 import jwt
-import requests
+import httpx
+import asyncio
 import hashlib
 import hmac
+from datetime import datetime
+from typing import Dict, Optional, Tuple
 from utils.constants import GITHUB_APP_ID, GITHUB_PRIVATE_KEY
 
+GITHUB_API_URL = "https://api.github.com"
+
+# Shared keep-alive pool for every GitHub call made by the webhook handlers
+GITHUB_MAX_CONNECTIONS = int(os.getenv("GITHUB_MAX_CONNECTIONS", "20"))
+GITHUB_MAX_KEEPALIVE   = int(os.getenv("GITHUB_MAX_KEEPALIVE", "10"))
+GITHUB_KEEPALIVE_EXPIRY = 60
+GITHUB_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+# Installation tokens live for an hour, renew them this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+GITHUB_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+    "User-Agent": "pr-review-bot",
+}
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide GitHub HTTP client, created on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+
+        _http_client = httpx.AsyncClient(
+            base_url=GITHUB_API_URL,
+            headers=GITHUB_HEADERS,
+            http2=http2,
+            timeout=GITHUB_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=GITHUB_MAX_CONNECTIONS,
+                max_keepalive_connections=GITHUB_MAX_KEEPALIVE,
+                keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+async def close_http_client():
+    """Close the shared client and its pooled connections"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def github_request(method: str, url: str, token: str, **kwargs) -> httpx.Response:
+    """
+    Send an authenticated request through the shared pool, url may be a path or an absolute API url.
+    A 401 for an installation token (e.g. revoked by a reinstall) invalidates it and retries once with a new one.
+    """
+    extra_headers = kwargs.pop("headers", {})
+    response = await get_http_client().request(method, url, headers={"Authorization": f"Bearer {token}", **extra_headers}, **kwargs)
+
+    installation_id = token_cache.installation_for(token)
+    if response.status_code == 401 and installation_id is not None:
+        token_cache.invalidate(installation_id, token)
+        token = await token_cache.get(installation_id)
+        response = await get_http_client().request(method, url, headers={"Authorization": f"Bearer {token}", **extra_headers}, **kwargs)
+    return response
+
 def get_github_app_jwt():
     """Create a JWT for the GitHub App"""
     if not GITHUB_APP_ID or not GITHUB_PRIVATE_KEY:
@@ -23,26 +90,98 @@ def get_github_app_jwt():
         algorithm="RS256"
     )
 
-def get_installation_access_token(installation_id: int):
-    """Get an installation access token"""
-    jwt_token = get_github_app_jwt()
-    headers = {
-        "Authorization": f"Bearer {jwt_token}",
-        "Accept": "application/vnd.github.v3+json",
-    }
+class InstallationTokenCache:
+    """
+    Installation access tokens keyed by installation id.
+    Concurrent callers share a single in-flight mint, and tokens used since they were
+    minted are renewed in the background shortly before they expire.
+    """
+
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[int, Tuple[str, float]] = {}
+        self._installations: Dict[str, Tuple[int, float]] = {}
+        self._used: Dict[int, bool] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._renewals: Dict[int, asyncio.Task] = {}
+
+    async def get(self, installation_id: int) -> str:
+        self._used[installation_id] = True
+        cached = self._tokens.get(installation_id)
+        if cached and cached[1] - time.time() > self.refresh_margin:
+            return cached[0]
+        return await self._refresh(installation_id)
+
+    def invalidate(self, installation_id: int, token: Optional[str] = None):
+        """Forget a token GitHub rejected, the next get mints a new one. Skipped if `token` was already replaced"""
+        cached = self._tokens.get(installation_id)
+        if cached and (token is None or cached[0] == token):
+            del self._tokens[installation_id]
+
+    def installation_for(self, token: str) -> Optional[int]:
+        """Installation a token minted by this cache belongs to, None for other tokens (e.g. app JWTs)"""
+        entry = self._installations.get(token)
+        return entry[0] if entry else None
+
+    def close(self):
+        """Cancel pending background renewals"""
+        for task in self._renewals.values():
+            task.cancel()
+        self._renewals.clear()
+
+    async def _refresh(self, installation_id: int) -> str:
+        task = self._inflight.get(installation_id)
+        if task is None:
+            task = asyncio.create_task(self._mint(installation_id))
+            self._inflight[installation_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(installation_id, None))
+        # Shielded so a cancelled caller doesn't cancel the mint other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _mint(self, installation_id: int) -> str:
+        jwt_token = get_github_app_jwt()
+        response = await github_request("POST", f"/app/installations/{installation_id}/access_tokens", jwt_token)
+        response.raise_for_status()
+
+        data = response.json()
+        expires_at = datetime.fromisoformat(data["expires_at"].replace("Z", "+00:00")).timestamp()
+        self._tokens[installation_id] = (data["token"], expires_at)
+        now = time.time()
+        self._installations = {token: entry for token, entry in self._installations.items() if entry[1] > now}
+        self._installations[data["token"]] = (installation_id, expires_at)
+        self._used[installation_id] = False
+        self._schedule_renewal(installation_id, expires_at)
+        return data["token"]
+
+    def _schedule_renewal(self, installation_id: int, expires_at: float):
+        previous = self._renewals.pop(installation_id, None)
+        if previous:
+            previous.cancel()
+        delay = max(expires_at - self.refresh_margin - time.time(), 0)
+        self._renewals[installation_id] = asyncio.create_task(self._renew(installation_id, delay))
+
+    async def _renew(self, installation_id: int, delay: float):
+        await asyncio.sleep(delay)
+        self._renewals.pop(installation_id, None)
+        if not self._used.get(installation_id):
+            # Idle installation, let the token lapse and mint on the next request instead
+            return
+        try:
+            await self._refresh(installation_id)
+        except Exception as exc:
+            print(f"⚠️ Failed to renew installation token for {installation_id}: {exc}")
 
-    url = f"https://api.github.com/app/installations/{installation_id}/access_tokens"
-    response = requests.post(url, headers=headers)
-    response.raise_for_status()
+token_cache = InstallationTokenCache()
 
-    data = response.json()
-    return data["token"]
+async def get_installation_access_token(installation_id: int):
+    """Get an installation access token, served from the cache while it is valid"""
+    return await token_cache.get(installation_id)
 
 async def get_github_client(installation_id: int):
     """Get an authenticated GitHub API client for an installation"""
     from github import Github
 
-    token = get_installation_access_token(installation_id)
+    token = await get_installation_access_token(installation_id)
     return Github(token)
 
 def verify_github_signature(payload_body: bytes, signature: str, secret: str) -> bool:
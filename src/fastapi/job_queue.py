@@ -0,0 +1,196 @@
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Dict, Optional
+
+# Jobs left in these states by a crashed process are run again on startup
+UNFINISHED_STATUSES = ("queued", "running")
+# Finished jobs are kept this long for the status endpoint
+JOB_RETENTION = 7 * 24 * 60 * 60
+
+Handler = Callable[[dict], Awaitable]
+
+
+def job_key(event: str, payload: dict) -> str:
+    """Concurrency key of a webhook job, one pull request / issue when there is one, else the repository."""
+    repo = payload.get("repository", {}).get("full_name", "")
+    number = (payload.get("pull_request") or payload.get("issue") or {}).get("number")
+    return f"{repo}#{number}" if number else repo
+
+
+class JobQueue:
+    """
+    In-process webhook job queue backed by SQLite.
+    A bounded pool of workers runs jobs, at most `max_per_key` at a time for the same key.
+    Jobs for a busy key are parked and requeued when the running one finishes, so they
+    never hold a worker while waiting.
+
+    Coalescing jobs wait `coalesce_window` seconds before they run, a newer coalescing job
+    for the same key supersedes the one still waiting.
+    """
+
+    def __init__(self, handlers: Dict[str, Handler], path: str, workers: int = 4, max_per_key: int = 1, coalesce_window: float = 0):
+        self.handlers = handlers
+        self.workers = workers
+        self.max_per_key = max_per_key
+        self.coalesce_window = coalesce_window
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._jobs: Dict[str, tuple] = {}
+        self._active: Dict[str, int] = defaultdict(int)
+        self._parked: Dict[str, deque] = defaultdict(deque)
+        self._coalescing: Dict[str, str] = {}
+        self._tasks = []
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                delivery_id TEXT UNIQUE,
+                event TEXT NOT NULL,
+                job_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def start(self):
+        """Requeue unfinished jobs from a previous run and start the workers."""
+        self._conn.execute(
+            f"DELETE FROM jobs WHERE status NOT IN ({','.join('?' * len(UNFINISHED_STATUSES))}) AND updated_at < ?",
+            (*UNFINISHED_STATUSES, time.time() - JOB_RETENTION)
+        )
+        self._conn.commit()
+
+        rows = self._conn.execute(
+            f"SELECT id, event, job_key, payload FROM jobs WHERE status IN ({','.join('?' * len(UNFINISHED_STATUSES))}) ORDER BY created_at",
+            UNFINISHED_STATUSES
+        ).fetchall()
+        for job_id, event, key, payload in rows:
+            self._jobs[job_id] = (event, key, json.loads(payload))
+            self._set_status(job_id, "queued")
+            self._queue.put_nowait(job_id)
+        if rows:
+            print(f"Recovered {len(rows)} unfinished webhook jobs")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers, jobs still queued or running are recovered on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._conn.close()
+
+    def find_delivery(self, delivery_id: str) -> Optional[str]:
+        """Id of the job already queued for a webhook delivery, if any."""
+        row = self._conn.execute("SELECT id FROM jobs WHERE delivery_id = ?", (delivery_id,)).fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, event: str, payload: dict, delivery_id: Optional[str] = None, coalesce: bool = False) -> str:
+        """Persist a job and queue it, returning its id."""
+        job_id = uuid.uuid4().hex
+        key = job_key(event, payload)
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO jobs (id, delivery_id, event, job_key, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, delivery_id, event, key, json.dumps(payload), now, now)
+        )
+        self._conn.commit()
+        self._jobs[job_id] = (event, key, payload)
+
+        if not coalesce:
+            self._queue.put_nowait(job_id)
+            return job_id
+
+        previous = self._coalescing.get(key)
+        if previous in self._jobs:
+            self._supersede(previous, key)
+        self._coalescing[key] = job_id
+        asyncio.get_running_loop().call_later(self.coalesce_window, self._queue.put_nowait, job_id)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT event, job_key, status, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        event, key, status, error, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "event": event,
+            "key": key,
+            "status": status,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def stats(self) -> dict:
+        counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "workers": self.workers,
+            "max_per_key": self.max_per_key,
+            "queued": self._queue.qsize(),
+            "parked": sum(len(jobs) for jobs in self._parked.values()),
+            "running": sum(self._active.values()),
+            "jobs": counts,
+        }
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            if job_id not in self._jobs:
+                # Superseded while it waited
+                continue
+            event, key, payload = self._jobs[job_id]
+
+            if self._active[key] >= self.max_per_key:
+                self._parked[key].append(job_id)
+                continue
+
+            if self._coalescing.get(key) == job_id:
+                del self._coalescing[key]
+            self._active[key] += 1
+            self._set_status(job_id, "running")
+            try:
+                await self.handlers[event](payload)
+                self._set_status(job_id, "done")
+            except asyncio.CancelledError:
+                # Shutting down, leave the job as running so it is recovered
+                raise
+            except Exception as exc:
+                print(f"⚠️ Webhook job {job_id} ({event}) failed: {exc}")
+                self._set_status(job_id, "failed", str(exc))
+            finally:
+                self._jobs.pop(job_id, None)
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+                if self._parked[key]:
+                    self._queue.put_nowait(self._parked[key].popleft())
+                if not self._parked[key]:
+                    del self._parked[key]
+
+    def _supersede(self, job_id: str, key: str):
+        """Drop a job that hasn't started, a newer job for the same key replaces it."""
+        del self._jobs[job_id]
+        if job_id in self._parked.get(key, ()):
+            self._parked[key].remove(job_id)
+        self._set_status(job_id, "superseded")
+
+    def _set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+        self._conn.commit()
@@ -1,23 +1,48 @@
 import os
 import json
+import asyncio
 from fastapi import FastAPI, Request, HTTPException, Header
 from typing import Optional
 from dotenv import load_dotenv
-from github_client import verify_github_signature
-from utils.constants import CEREBRAS_MODEL, GITHUB_WEBHOOK_SECRET
-from letta.pr_reviewer import EVENT_HANDLERS
+from github_client import verify_github_signature, close_http_client, token_cache
+from utils.constants import CEREBRAS_MODEL, GITHUB_WEBHOOK_SECRET, JOB_QUEUE_PATH, JOB_QUEUE_WORKERS, JOB_QUEUE_MAX_PER_KEY, REVIEW_COALESCE_WINDOW
+from letta.pr_reviewer import EVENT_HANDLERS, memory_manager, invalidate_pr_context
+from job_queue import JobQueue
 
 load_dotenv()  # Load variables from .env if present
 
 app = FastAPI(title="PR Review Bot", version="1.1.0")
 
+# Webhook events are handled in the background, the webhook only verifies and enqueues them
+job_queue = JobQueue(
+    EVENT_HANDLERS, JOB_QUEUE_PATH,
+    workers=JOB_QUEUE_WORKERS, max_per_key=JOB_QUEUE_MAX_PER_KEY, coalesce_window=REVIEW_COALESCE_WINDOW
+)
+
+# Pull request actions that trigger a full review, a burst of them is coalesced into one review of the latest head
+REVIEW_ACTIONS = ("opened", "synchronize", "reopened")
+
+@app.on_event("startup")
+async def startup():
+    """Start the webhook job workers, and detach user blocks older versions left on the shared agent"""
+    job_queue.start()
+    await asyncio.to_thread(memory_manager.detach_managed_blocks)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the job workers and token renewals, close pooled GitHub connections"""
+    await job_queue.stop()
+    token_cache.close()
+    await close_http_client()
+
 # Configuration
 #
-@app.post("/app-webhook", tags=["GitHub App"])
+@app.post("/app-webhook", tags=["GitHub App"], status_code=202)
 async def github_app_webhook_handler(
     request: Request,
     x_hub_signature_256: Optional[str] = Header(None, alias="X-Hub-Signature-256"),
-    x_github_event: Optional[str] = Header(None, alias="X-GitHub-Event")
+    x_github_event: Optional[str] = Header(None, alias="X-GitHub-Event"),
+    x_github_delivery: Optional[str] = Header(None, alias="X-GitHub-Delivery")
 ):
     """Handle GitHub App webhook events"""
 
@@ -42,15 +67,40 @@ async def github_app_webhook_handler(
         print("Received event with no event type")
         return {"message": "App webhook received"}
 
-    handler = EVENT_HANDLERS.get(x_github_event, "")
-    if handler:
-        print(f"Calling handler for event: {x_github_event}")
-        await handler(payload)
-    else:
-        print(f"Received unhandled App event: {x_github_event} (no handler registered)")
+    if x_github_event in EVENT_HANDLERS:
+        # GitHub redelivers on timeout, only the first delivery is handled
+        existing = job_queue.find_delivery(x_github_delivery) if x_github_delivery else None
+        if existing:
+            print(f"Ignoring duplicate delivery {x_github_delivery} (job {existing})")
+            return {"message": "Duplicate delivery", "job_id": existing}
+
+        if x_github_event == "pull_request":
+            # Drop the cached PR context right away, not when the queued event runs
+            invalidate_pr_context(payload)
+
+        coalesce = x_github_event == "pull_request" and payload.get("action") in REVIEW_ACTIONS
+        job_id = job_queue.enqueue(x_github_event, payload, delivery_id=x_github_delivery, coalesce=coalesce)
+        print(f"Queued job {job_id} for event: {x_github_event}")
+        return {"message": "App webhook queued", "job_id": job_id}
+
+    print(f"Received unhandled App event: {x_github_event} (no handler registered)")
     return {"message": "App webhook received"}
 
 
+@app.get("/jobs", tags=["GitHub App"])
+async def jobs_status():
+    """Webhook job queue counters"""
+    return job_queue.stats()
+
+@app.get("/jobs/{job_id}", tags=["GitHub App"])
+async def job_status(job_id: str):
+    """Status of a queued webhook job"""
+    job = job_queue.status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """Simple health check endpoint"""
@@ -64,9 +114,11 @@ async def status():
         "webhook_secret_configured": bool(GITHUB_WEBHOOK_SECRET),
         "model_provider": "cerebras",
         "model": CEREBRAS_MODEL,
+        "memory_cache": memory_manager.cache_stats(),
         "endpoints": {
             "legacy_webhook": "/webhook",
             "app_webhook": "/app-webhook",
+            "jobs": "/jobs",
             "health": "/",
             "status": "/status"
         }
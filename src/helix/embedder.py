@@ -0,0 +1,205 @@
+"""
+Embedding backends for the codebase index.
+
+Every backend embeds text in batches of `batch_size`. Wrap a backend in a
+`CachedEmbedder` so identical chunks (across files, repos and re-ingests) are
+only ever embedded once.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List, Sequence
+
+EMBEDDING_MODEL      = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BACKEND    = os.getenv("EMBEDDING_BACKEND", "torch")  # torch, onnx or constant (placeholder vectors, tests only)
+# Every vector in the EmbeddedCode index has this size, all-MiniLM-L6-v2 embeds into 384 dimensions
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "384"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or os.path.expanduser("~/.cache/helix/embeddings.sqlite3")
+
+# Max number of keys per sqlite IN (...) lookup
+CACHE_LOOKUP_SIZE = 500
+
+
+class Embedder:
+    """Base embedding backend, subclasses implement `_embed_batch`."""
+
+    def __init__(self, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    @property
+    def name(self) -> str:
+        """Identifies the model, vectors from different models never share a cache entry."""
+        return type(self).__name__
+
+    @property
+    def max_tokens(self) -> int:
+        """Longest input the model embeds without truncating."""
+        return 512
+
+    def count_tokens(self, text: str) -> int:
+        """Rough estimate for backends without a tokenizer, about 4 characters per token for code."""
+        return len(text) // 4 + 1
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts in batches of `batch_size`, returning one vector per text."""
+        texts = list(texts)
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[i:i + self.batch_size]))
+        return vectors
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class ConstantEmbedder(Embedder):
+    """Placeholder backend returning the same vector for every text, only used with EMBEDDING_BACKEND=constant (tests)."""
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, batch_size: int = EMBEDDING_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.dimensions = dimensions
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [[0.1] * self.dimensions for _ in texts]
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Local CPU backend using sentence-transformers, the model is loaded once per process on first use."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND, batch_size: int = EMBEDDING_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.model_name
+
+    @property
+    def max_tokens(self) -> int:
+        # max_seq_length includes the special tokens ([CLS], [SEP]) the model adds, count_tokens doesn't
+        special_tokens = len(self.model.tokenizer("", add_special_tokens=True)["input_ids"])
+        return self.model.max_seq_length - special_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.model.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    kwargs = {"device": "cpu"}
+                    if self.backend == "onnx":
+                        kwargs["backend"] = "onnx"
+                    self._model = SentenceTransformer(self.model_name, **kwargs)
+        return self._model
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype("float64").tolist()
+
+
+class CachedEmbedder(Embedder):
+    """
+    Wraps a backend with an on-disk cache keyed by a hash of the model name and text.
+    Only texts missing from the cache are sent to the backend, duplicates within a call are embedded once.
+    """
+
+    def __init__(self, backend: Embedder, path: str = EMBEDDING_CACHE_PATH):
+        super().__init__(backend.batch_size)
+        self.backend = backend
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def max_tokens(self) -> int:
+        return self.backend.max_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return self.backend.count_tokens(text)
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.backend.name}\0{text}".encode("utf8")).hexdigest()
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        texts = list(texts)
+        keys = [self.key(text) for text in texts]
+        vectors = self._load(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.backend.embed(list(missing.values()))
+            new_entries = dict(zip(missing.keys(), new_vectors))
+            self._store(new_entries)
+            vectors.update(new_entries)
+
+        return [vectors[key] for key in keys]
+
+    def _load(self, keys) -> dict:
+        keys = list(keys)
+        vectors = {}
+        with self._lock:
+            for i in range(0, len(keys), CACHE_LOOKUP_SIZE):
+                batch = keys[i:i + CACHE_LOOKUP_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = array("d", blob).tolist()
+        return vectors
+
+    def _store(self, vectors: dict):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("d", vector).tobytes()) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+
+
+def get_embedder() -> Embedder:
+    """Return the configured cached embedder, constant placeholder vectors only when EMBEDDING_BACKEND=constant."""
+    if EMBEDDING_BACKEND == "constant":
+        print("WARNING: EMBEDDING_BACKEND=constant, writing placeholder embeddings")
+        return ConstantEmbedder()
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        raise ImportError("sentence-transformers is required to embed code, install it or set EMBEDDING_BACKEND=constant")
+    return CachedEmbedder(SentenceTransformerEmbedder())
+
+
+def check_dimensions(vector: Sequence[float]):
+    """Refuse vectors that don't match the index, a model change would otherwise mix sizes in one HNSW index."""
+    if len(vector) != EMBEDDING_DIMENSIONS:
+        raise ValueError(f"Embedding has {len(vector)} dimensions, the index expects EMBEDDING_DIMENSIONS={EMBEDDING_DIMENSIONS}")
@@ -3,17 +3,22 @@ QUERY createUser(username: String) =>
     user <- AddN<User>({username: username})
     RETURN user
 
+QUERY upsertUser(username: String) =>
+    existing <- N<User>({username: username})
+    user <- existing::UpsertN({username: username})
+    RETURN user
+
 QUERY getUser(username: String) =>
-    user <- N<User>::WHERE(_::{username}::EQ(username))
+    user <- N<User>({username: username})
     RETURN user
 
 QUERY getAllUsers() =>
     users <- N<User>
     RETURN users
 
-// Repository Management
+// Repository Management - looked up through the full_name secondary index
 QUERY createRepository(username: String, repo_name: String, full_name: String) =>
-    user <- N<User>::WHERE(_::{username}::EQ(username))
+    user <- N<User>({username: username})
     repo <- AddN<Repository>({
         owner: username,
         name: repo_name,
@@ -22,40 +27,102 @@ QUERY createRepository(username: String, repo_name: String, full_name: String) =
     AddE<User_to_Repository>()::From(user)::To(repo)
     RETURN repo
 
-QUERY getRepository(owner: String, repo_name: String) =>
-    repo <- N<Repository>::WHERE(_::{owner}::EQ(owner))::WHERE(_::{name}::EQ(repo_name))
+// Idempotent, creates the owner too and reuses both nodes and their edge on re-runs
+QUERY upsertRepository(username: String, repo_name: String, full_name: String) =>
+    existing_user <- N<User>({username: username})
+    user <- existing_user::UpsertN({username: username})
+    existing_repo <- N<Repository>({full_name: full_name})
+    repo <- existing_repo::UpsertN({
+        owner: username,
+        name: repo_name,
+        full_name: full_name
+    })
+    existing_edge <- user::OutE<User_to_Repository>
+    existing_edge::UpsertE()::From(user)::To(repo)
+    RETURN repo
+
+QUERY getRepository(full_name: String) =>
+    repo <- N<Repository>({full_name: full_name})
     RETURN repo
 
 QUERY getUserRepositories(username: String) =>
-    user <- N<User>::WHERE(_::{username}::EQ(username))
+    user <- N<User>({username: username})
     repos <- user::Out<User_to_Repository>
     RETURN repos
 
 
-// Create Folders - scoped to repository
-QUERY createSuperFolder(owner: String, repo_name: String, folder_name: String) =>
-    repo <- N<Repository>::WHERE(_::{owner}::EQ(owner))::WHERE(_::{name}::EQ(repo_name))
-    folder <- AddN<Folder>({name: folder_name})
-    AddE<Repository_to_Folder>()::From(repo)::To(folder)
+// Create Folders - scoped to repository, keyed by repo_path ("owner/name/path")
+QUERY createSuperFolder(folder_name: String, repo: String, path: String, repo_path: String) =>
+    repository <- N<Repository>({full_name: repo})
+    folder <- AddN<Folder>({name: folder_name, repo: repo, path: path, repo_path: repo_path})
+    AddE<Repository_to_Folder>()::From(repository)::To(folder)
+    AddE<Repository_to_TreeFolder>()::From(repository)::To(folder)
     RETURN folder
 
-QUERY createSubFolder(folder_id: ID, name: String) =>
+QUERY createSubFolder(folder_id: ID, name: String, repo: String, path: String, repo_path: String) =>
+    repository <- N<Repository>({full_name: repo})
     folder <- N<Folder>(folder_id)
-    subfolder <- AddN<Folder>({name: name})
+    subfolder <- AddN<Folder>({name: name, repo: repo, path: path, repo_path: repo_path})
     AddE<Folder_to_Folder>()::From(folder)::To(subfolder)
+    AddE<Repository_to_TreeFolder>()::From(repository)::To(subfolder)
     RETURN subfolder
 
-// Create Files - scoped to repository
-QUERY createSuperFile(owner: String, repo_name: String, file_name: String, extension: String, text: String) =>
-    repo <- N<Repository>::WHERE(_::{owner}::EQ(owner))::WHERE(_::{name}::EQ(repo_name))
-    file <- AddN<File>({name: file_name, extension: extension, text: text})
-    AddE<Repository_to_File>()::From(repo)::To(file)
+QUERY upsertSuperFolder(folder_name: String, repo: String, path: String, repo_path: String) =>
+    repository <- N<Repository>({full_name: repo})
+    existing <- N<Folder>({repo_path: repo_path})
+    folder <- existing::UpsertN({name: folder_name, repo: repo, path: path, repo_path: repo_path})
+    existing_edge <- repository::OutE<Repository_to_Folder>
+    existing_edge::UpsertE()::From(repository)::To(folder)
+    existing_tree_edge <- repository::OutE<Repository_to_TreeFolder>
+    existing_tree_edge::UpsertE()::From(repository)::To(folder)
+    RETURN folder
+
+QUERY upsertSubFolder(folder_id: ID, name: String, repo: String, path: String, repo_path: String) =>
+    repository <- N<Repository>({full_name: repo})
+    folder <- N<Folder>(folder_id)
+    existing <- N<Folder>({repo_path: repo_path})
+    subfolder <- existing::UpsertN({name: name, repo: repo, path: path, repo_path: repo_path})
+    existing_edge <- folder::OutE<Folder_to_Folder>
+    existing_edge::UpsertE()::From(folder)::To(subfolder)
+    existing_tree_edge <- repository::OutE<Repository_to_TreeFolder>
+    existing_tree_edge::UpsertE()::From(repository)::To(subfolder)
+    RETURN subfolder
+
+// Create Files - scoped to repository, keyed by repo_path ("owner/name/path")
+QUERY createSuperFile(file_name: String, extension: String, text: String, repo: String, path: String, repo_path: String, content_hash: String) =>
+    repository <- N<Repository>({full_name: repo})
+    file <- AddN<File>({name: file_name, extension: extension, text: text, repo: repo, path: path, repo_path: repo_path, content_hash: content_hash})
+    AddE<Repository_to_File>()::From(repository)::To(file)
+    AddE<Repository_to_TreeFile>()::From(repository)::To(file)
     RETURN file
 
-QUERY createFile(folder_id: ID, name: String, extension: String, text: String) =>
+QUERY createFile(folder_id: ID, name: String, extension: String, text: String, repo: String, path: String, repo_path: String, content_hash: String) =>
+    repository <- N<Repository>({full_name: repo})
     folder <- N<Folder>(folder_id)
-    file <- AddN<File>({name: name, extension: extension, text: text})
+    file <- AddN<File>({name: name, extension: extension, text: text, repo: repo, path: path, repo_path: repo_path, content_hash: content_hash})
     AddE<Folder_to_File>()::From(folder)::To(file)
+    AddE<Repository_to_TreeFile>()::From(repository)::To(file)
+    RETURN file
+
+QUERY upsertSuperFile(file_name: String, extension: String, text: String, repo: String, path: String, repo_path: String, content_hash: String) =>
+    repository <- N<Repository>({full_name: repo})
+    existing <- N<File>({repo_path: repo_path})
+    file <- existing::UpsertN({name: file_name, extension: extension, text: text, repo: repo, path: path, repo_path: repo_path, content_hash: content_hash})
+    existing_edge <- repository::OutE<Repository_to_File>
+    existing_edge::UpsertE()::From(repository)::To(file)
+    existing_tree_edge <- repository::OutE<Repository_to_TreeFile>
+    existing_tree_edge::UpsertE()::From(repository)::To(file)
+    RETURN file
+
+QUERY upsertFile(folder_id: ID, name: String, extension: String, text: String, repo: String, path: String, repo_path: String, content_hash: String) =>
+    repository <- N<Repository>({full_name: repo})
+    folder <- N<Folder>(folder_id)
+    existing <- N<File>({repo_path: repo_path})
+    file <- existing::UpsertN({name: name, extension: extension, text: text, repo: repo, path: path, repo_path: repo_path, content_hash: content_hash})
+    existing_edge <- folder::OutE<Folder_to_File>
+    existing_edge::UpsertE()::From(folder)::To(file)
+    existing_tree_edge <- repository::OutE<Repository_to_TreeFile>
+    existing_tree_edge::UpsertE()::From(repository)::To(file)
     RETURN file
 
 // Create Entities
@@ -65,10 +132,10 @@ QUERY createSuperEntity(file_id: ID, entity_type: String, start_byte: I64, end_b
     AddE<File_to_Entity>()::From(file)::To(entity)
     RETURN entity
 
-QUERY embedSuperEntity(entity_id: ID, vector: [F64]) =>
-    entity <- N<Entity>(entity_id)
+QUERY embedSuperEntity(hash: String, vector: [F64]) =>
+    content <- N<EmbeddedContent>({hash: hash})
     embedded_code <- AddV<EmbeddedCode>(vector)
-    AddE<Entity_to_EmbeddedCode>()::From(entity)::To(embedded_code)
+    AddE<EmbeddedContent_to_EmbeddedCode>()::From(content)::To(embedded_code)
     RETURN embedded_code
 
 QUERY createSubEntity(entity_id: ID, entity_type: String, start_byte: I64, end_byte: I64, order: I64, text: String) =>
@@ -77,6 +144,187 @@ QUERY createSubEntity(entity_id: ID, entity_type: String, start_byte: I64, end_b
     AddE<Entity_to_Entity>()::From(parent)::To(entity)
     RETURN entity
 
+// Bulk entity + embedding writes - one request per file / depth level / vector batch
+QUERY createSuperEntities(file_id: ID, entities: [{entity_type: String, start_byte: I64, end_byte: I64, order: I64, text: String, content_hash: String}]) =>
+    file <- N<File>(file_id)
+    FOR {entity_type, start_byte, end_byte, order, text, content_hash} IN entities {
+        entity <- AddN<Entity>({entity_type: entity_type, start_byte: start_byte, end_byte: end_byte, order: order, text: text, content_hash: content_hash})
+        AddE<File_to_Entity>()::From(file)::To(entity)
+    }
+    created <- file::Out<File_to_Entity>
+    RETURN created
+
+// One request per depth level of a file, rows carry their parent. Sub entities go MAX_DEPTH (2) levels deep
+QUERY createSubEntities(file_id: ID, entities: [{parent_id: ID, entity_type: String, start_byte: I64, end_byte: I64, order: I64, text: String, content_hash: String}]) =>
+    FOR {parent_id, entity_type, start_byte, end_byte, order, text, content_hash} IN entities {
+        parent <- N<Entity>(parent_id)
+        entity <- AddN<Entity>({entity_type: entity_type, start_byte: start_byte, end_byte: end_byte, order: order, text: text, content_hash: content_hash})
+        AddE<Entity_to_Entity>()::From(parent)::To(entity)
+    }
+    created <- N<File>(file_id)::Out<File_to_Entity>::Out<Entity_to_Entity>
+    nested <- created::Out<Entity_to_Entity>
+    RETURN created::{id: ID, order, parent: _::In<Entity_to_Entity>::{id: ID}}, nested::{id: ID, order, parent: _::In<Entity_to_Entity>::{id: ID}}
+
+// Links super entities to the content of their text, creating it when no entity had that text yet.
+// Contents without vectors (new, or left by an interrupted write) are embedded by the caller
+QUERY linkEntityContents(file_id: ID, entities: [{entity_id: ID, hash: String}]) =>
+    FOR {entity_id, hash} IN entities {
+        entity <- N<Entity>(entity_id)
+        existing <- N<EmbeddedContent>({hash: hash})
+        content <- existing::UpsertN({hash: hash})
+        AddE<Entity_to_EmbeddedContent>()::From(entity)::To(content)
+    }
+    contents <- N<File>(file_id)::Out<File_to_Entity>::Out<Entity_to_EmbeddedContent>
+    RETURN contents::{hash, vectors: _::Out<EmbeddedContent_to_EmbeddedCode>::COUNT}
+
+// All vectors of one content are sent in the same request, so a content is never left half embedded
+QUERY embedSuperEntities(embeddings: [{hash: String, vector: [F64]}]) =>
+    FOR {hash, vector} IN embeddings {
+        content <- N<EmbeddedContent>({hash: hash})
+        embedded_code <- AddV<EmbeddedCode>(vector)
+        AddE<EmbeddedContent_to_EmbeddedCode>()::From(content)::To(embedded_code)
+    }
+    RETURN "Success"
+
+// Incremental updates - diff the indexed tree by path and content hash
+QUERY getRepositoryFolders(repo: String) =>
+    folders <- N<Repository>({full_name: repo})::Out<Repository_to_TreeFolder>
+    RETURN folders::{id: ID, path}
+
+QUERY getRepositoryFiles(repo: String) =>
+    files <- N<Repository>({full_name: repo})::Out<Repository_to_TreeFile>
+    RETURN files::{id: ID, path, content_hash}
+
+QUERY getFileEntities(file_id: ID) =>
+    entities <- N<File>(file_id)::Out<File_to_Entity>
+    RETURN entities::{id: ID, start_byte, order, content_hash}
+
+QUERY updateFile(file_id: ID, text: String, content_hash: String) =>
+    file <- N<File>(file_id)::UPDATE({text: text, content_hash: content_hash})
+    RETURN file::{id: ID}
+
+// Blob store - file text keyed by content hash, shared across repositories and forks.
+// Every file links its Blob, which also groups files with identical contents for dedup
+QUERY linkFileBlob(file_id: ID, content_hash: String, text: String) =>
+    file <- N<File>(file_id)
+    DROP file::OutE<File_to_Blob>
+    existing <- N<Blob>({hash: content_hash})
+    blob <- existing::UpsertN({hash: content_hash, text: text})
+    AddE<File_to_Blob>()::From(file)::To(blob)
+    RETURN blob::{id: ID}
+
+// Inline mode - links the file to its hash node without storing the text a second time
+QUERY linkFileHash(file_id: ID, content_hash: String) =>
+    file <- N<File>(file_id)
+    DROP file::OutE<File_to_Blob>
+    existing <- N<Blob>({hash: content_hash})
+    blob <- existing::UpsertN({hash: content_hash})
+    AddE<File_to_Blob>()::From(file)::To(blob)
+    RETURN blob::{id: ID}
+
+QUERY getBlob(content_hash: String) =>
+    blob <- N<Blob>({hash: content_hash})
+    RETURN blob::{text}
+
+QUERY updateEntityPositions(entities: [{entity_id: ID, start_byte: I64, end_byte: I64, order: I64}]) =>
+    FOR {entity_id, start_byte, end_byte, order} IN entities {
+        N<Entity>(entity_id)::UPDATE({start_byte: start_byte, end_byte: end_byte, order: order})
+    }
+    RETURN "Success"
+
+// Sub entities only go MAX_DEPTH (2) levels deep, see ingestion.py
+QUERY deleteSubEntities(entity_ids: [ID]) =>
+    FOR entity_id IN entity_ids {
+        DROP N<Entity>(entity_id)::Out<Entity_to_Entity>::Out<Entity_to_Entity>
+        DROP N<Entity>(entity_id)::Out<Entity_to_Entity>
+    }
+    RETURN "Success"
+
+// Contents (and their vectors) are dropped once no entity links them
+QUERY deleteEntities(entity_ids: [ID]) =>
+    FOR entity_id IN entity_ids {
+        contents <- N<Entity>(entity_id)::Out<Entity_to_EmbeddedContent>
+        DROP N<Entity>(entity_id)::Out<Entity_to_Entity>::Out<Entity_to_Entity>
+        DROP N<Entity>(entity_id)::Out<Entity_to_Entity>
+        DROP N<Entity>(entity_id)
+        orphans <- contents::WHERE(_::In<Entity_to_EmbeddedContent>::COUNT::EQ(0))
+        DROP orphans::Out<EmbeddedContent_to_EmbeddedCode>
+        DROP orphans
+    }
+    RETURN "Success"
+
+// Files with identical contents share their entities, only entities no other file links are dropped
+QUERY deleteFile(file_id: ID) =>
+    owned <- N<File>(file_id)::Out<File_to_Entity>::WHERE(_::In<File_to_Entity>::COUNT::EQ(1))
+    contents <- owned::Out<Entity_to_EmbeddedContent>
+    DROP owned::Out<Entity_to_Entity>::Out<Entity_to_Entity>
+    DROP owned::Out<Entity_to_Entity>
+    DROP owned
+    orphans <- contents::WHERE(_::In<Entity_to_EmbeddedContent>::COUNT::EQ(0))
+    DROP orphans::Out<EmbeddedContent_to_EmbeddedCode>
+    DROP orphans
+    DROP N<File>(file_id)
+    RETURN "Success"
+
+QUERY unlinkFileEntities(file_id: ID) =>
+    owned <- N<File>(file_id)::Out<File_to_Entity>::WHERE(_::In<File_to_Entity>::COUNT::EQ(1))
+    contents <- owned::Out<Entity_to_EmbeddedContent>
+    DROP owned::Out<Entity_to_Entity>::Out<Entity_to_Entity>
+    DROP owned::Out<Entity_to_Entity>
+    DROP owned
+    orphans <- contents::WHERE(_::In<Entity_to_EmbeddedContent>::COUNT::EQ(0))
+    DROP orphans::Out<EmbeddedContent_to_EmbeddedCode>
+    DROP orphans
+    DROP N<File>(file_id)::OutE<File_to_Entity>
+    RETURN "Success"
+
+// Content-addressed dedup - files anywhere in the index with the given contents
+QUERY getFilesByHash(content_hash: String) =>
+    files <- N<Blob>({hash: content_hash})::In<File_to_Blob>
+    RETURN files::{id: ID}
+
+// Hides a file from getFilesByHash while its entities change, updateFile relinks it once they are written
+QUERY unlinkFileHash(file_id: ID) =>
+    file <- N<File>(file_id)::UPDATE({content_hash: ""})
+    DROP file::OutE<File_to_Blob>
+    RETURN "Success"
+
+QUERY linkFileEntities(file_id: ID, entity_ids: [ID]) =>
+    file <- N<File>(file_id)
+    FOR entity_id IN entity_ids {
+        entity <- N<Entity>(entity_id)
+        AddE<File_to_Entity>()::From(file)::To(entity)
+    }
+    RETURN "Success"
+
+QUERY deleteFolder(folder_id: ID) =>
+    DROP N<Folder>(folder_id)
+    RETURN "Success"
+
+// Code search - scoped to repository, each hit carries its file path and repository.
+// Only super entities store text, so BM25 never spends its top-k on sub entities
+// *_count is the size of the global top-k before the repository filter, fewer than k means the index has no more to give
+QUERY searchCode(repo: String, vector: [F64], k: I64) =>
+    vector_candidates <- SearchV<EmbeddedCode>(vector, k)
+    vector_hits <- vector_candidates::In<EmbeddedContent_to_EmbeddedCode>::In<Entity_to_EmbeddedContent>::WHERE(EXISTS(_::In<File_to_Entity>::WHERE(_::{repo}::EQ(repo))))
+    vector_count <- vector_candidates::COUNT
+    RETURN vector_hits::{id: ID, entity_type, start_byte, end_byte, text, file: _::In<File_to_Entity>::{id: ID, path, repo, content_hash}}, vector_count
+
+QUERY hybridSearchCode(repo: String, query: String, vector: [F64], k: I64) =>
+    vector_candidates <- SearchV<EmbeddedCode>(vector, k)
+    vector_hits <- vector_candidates::In<EmbeddedContent_to_EmbeddedCode>::In<Entity_to_EmbeddedContent>::WHERE(EXISTS(_::In<File_to_Entity>::WHERE(_::{repo}::EQ(repo))))
+    bm25_candidates <- SearchBM25<Entity>(query, k)
+    bm25_hits <- bm25_candidates::WHERE(EXISTS(_::In<File_to_Entity>::WHERE(_::{repo}::EQ(repo))))
+    vector_count <- vector_candidates::COUNT
+    bm25_count <- bm25_candidates::COUNT
+    RETURN vector_hits::{id: ID, entity_type, start_byte, end_byte, text, file: _::In<File_to_Entity>::{id: ID, path, repo, content_hash}}, bm25_hits::{id: ID, entity_type, start_byte, end_byte, text, file: _::In<File_to_Entity>::{id: ID, path, repo, content_hash}}, vector_count, bm25_count
+
+// Review context - a file by repo_path ("owner/name/path") with its top level entities
+QUERY getFileContext(repo_path: String) =>
+    file <- N<File>({repo_path: repo_path})
+    entities <- file::Out<File_to_Entity>
+    RETURN file::{id: ID, text, content_hash}, entities::{id: ID, entity_type, start_byte, end_byte, order, text}
+
 QUERY getRepositoryById(repo_id: ID) =>
     repo <- N<Repository>(repo_id)
     RETURN repo
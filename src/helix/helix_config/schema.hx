@@ -1,6 +1,6 @@
 // User represents a GitHub account/organization that owns repositories
 N::User {
-    username: String,
+    username: String,      // Unique (secondary index)
     created_at: Date DEFAULT NOW
 }
 
@@ -8,28 +8,47 @@ N::User {
 N::Repository {
     owner: String,         // GitHub username of the owner
     name: String,          // Repository name
-    full_name: String,     // Combined as "owner/name"
+    full_name: String,     // Combined as "owner/name", unique (secondary index)
     extracted_at: Date DEFAULT NOW
 }
 
 N::Folder {
     name: String,
+    repo: String DEFAULT "",           // Owning repository full_name
+    path: String DEFAULT "",           // Path relative to the repository root
+    repo_path: String DEFAULT "",      // "owner/name/path", unique key (secondary index)
     extracted_at: Date DEFAULT NOW
 }
 
 N::File {
     name: String,
     extension: String,
-    text: String,
+    text: String,                      // Empty in blob mode, see File_to_Blob
+    repo: String DEFAULT "",           // Owning repository full_name
+    path: String DEFAULT "",           // Path relative to the repository root
+    repo_path: String DEFAULT "",      // "owner/name/path", unique key (secondary index)
+    content_hash: String DEFAULT "",   // SHA-1 of the file contents, used for incremental updates
     extracted_at: Date DEFAULT NOW
 }
 
+// Content-addressed file contents, shared by every File with the same contents across repositories
+N::Blob {
+    hash: String,                      // SHA-1 of the contents (File.content_hash), unique (secondary index)
+    text: String DEFAULT ""            // Only stored in blob mode
+}
+
+// Content-addressed super entity text, owns the vectors of every super entity with that text
+N::EmbeddedContent {
+    hash: String                       // SHA-1 of the entity text (Entity.content_hash), unique (secondary index)
+}
+
 N::Entity {
     entity_type: String,
     start_byte: I64,
     end_byte: I64,
     order: I64,
-    text: String,
+    text: String,                      // Super entities only, empty in blob mode (sliced from the file's Blob on read)
+    content_hash: String DEFAULT "",   // SHA-1 of the entity text
     extracted_at: Date DEFAULT NOW
 }
 
@@ -58,6 +77,21 @@ E::Repository_to_File {
     }
 }
 
+// Every folder / file of a repository at any depth, so per repository listings don't scan all nodes
+E::Repository_to_TreeFolder {
+    From: Repository,
+    To: Folder,
+    Properties: {
+    }
+}
+
+E::Repository_to_TreeFile {
+    From: Repository,
+    To: File,
+    Properties: {
+    }
+}
+
 E::Folder_to_Folder {
     From: Folder,
     To: Folder,
@@ -72,6 +106,14 @@ E::Folder_to_File {
     }
 }
 
+E::File_to_Blob {
+    From: File,
+    To: Blob,
+    Properties: {
+    }
+}
+
+// Files with identical contents link the same entities, which are parsed and embedded once
 E::File_to_Entity {
     From: File,
     To: Entity,
@@ -86,8 +128,17 @@ E::Entity_to_Entity {
     }
 }
 
-E::Entity_to_EmbeddedCode {
+// Super entities with identical text in any file of any repository link one EmbeddedContent,
+// embedded once. Positions stay on each Entity, only the text's vectors are shared
+E::Entity_to_EmbeddedContent {
     From: Entity,
+    To: EmbeddedContent,
+    Properties: {
+    }
+}
+
+E::EmbeddedContent_to_EmbeddedCode {
+    From: EmbeddedContent,
     To: EmbeddedCode,
     Properties: {
     }
@@ -2,8 +2,12 @@
 Memory Manager for Toph Bot - Handles user preferences per codebase
 """
 
+import time
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import threading
+from collections import defaultdict, OrderedDict
+from typing import Optional, Dict, Any, List, Set
 from letta_client import Letta
 from .preference_extractor import PreferenceExtractor, UserPreferences
 
@@ -11,6 +15,118 @@ from .preference_extractor import PreferenceExtractor, UserPreferences
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# The block index is reloaded after this many seconds to pick up blocks created by other processes
+BLOCK_INDEX_MAX_AGE = 10 * 60
+# Blocks fetched per page of the listing the index is loaded from
+BLOCK_LIST_PAGE_SIZE = 100
+
+# Preference blocks rarely change, cached reads are served for this many seconds
+PREFERENCE_CACHE_TTL = 5 * 60
+PREFERENCE_CACHE_SIZE = 1024
+
+# Labels of the blocks created by the manager, any other block attached to the agent is its own core memory
+MANAGED_LABEL_SUFFIXES = ("_preferences", "_codebase_context")
+
+# A user's memory blocks are sent in the prompt, cut to this many characters (prompts.AGENT_OVERHEAD_TOKENS covers them)
+USER_MEMORY_MAX_CHARS = 16_000
+
+# Cache marker for a key that isn't cached, None is a valid cached value (no block)
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache whose entries also expire `ttl` seconds after they were set"""
+
+    def __init__(self, maxsize: int = PREFERENCE_CACHE_SIZE, ttl: float = PREFERENCE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str, default=MISSING):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class BlockIndex:
+    """
+    Local index of Letta memory blocks, label -> block id and user -> block labels.
+    Loaded lazily by paging through the block listing and kept coherent as blocks are created or modified.
+    It can be up to max_age stale, so a label it doesn't know is not proof the block doesn't exist.
+    """
+
+    def __init__(self, letta_client: Letta, max_age: float = BLOCK_INDEX_MAX_AGE):
+        self.client = letta_client
+        self.max_age = max_age
+        self._by_label: Dict[str, str] = {}
+        self._by_user: Dict[str, Set[str]] = defaultdict(set)  # user -> labels
+        self._loaded_at: Optional[float] = None
+        # Lookups run in worker threads, so only one of them reloads the index at a time
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _user_of(label: str) -> str:
+        # Labels start with the user or owner login, GitHub logins never contain underscores
+        return label.split("_", 1)[0]
+
+    def refresh(self):
+        """Rebuild the index from every page of the block listing"""
+        # Filled aside and swapped in, lookups in other threads never see a half built index
+        index = BlockIndex(self.client, self.max_age)
+        after = None
+        while True:
+            page = list(self.client.blocks.list(limit=BLOCK_LIST_PAGE_SIZE, **({"after": after} if after else {})))
+            for block in page:
+                index.add(block)
+            if len(page) < BLOCK_LIST_PAGE_SIZE:
+                break
+            after = page[-1].id
+        self._by_label, self._by_user = index._by_label, index._by_user
+        self._loaded_at = time.monotonic()
+        logger.info(f"Indexed {len(self._by_label)} memory blocks")
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+                self.refresh()
+
+    def add(self, block):
+        """Record a created or modified block"""
+        label = getattr(block, "label", None)
+        if not label or not getattr(block, "id", None):
+            return
+        self._by_label[label] = block.id
+        self._by_user[self._user_of(label)].add(label)
+
+    def get(self, label: str) -> Optional[str]:
+        """Block id for a label"""
+        self._ensure_loaded()
+        return self._by_label.get(label)
+
+    def user_labels(self, user_id: str) -> List[str]:
+        """Labels of every block that belongs to user_id, sorted"""
+        self._ensure_loaded()
+        return sorted(self._by_user.get(user_id, ()))
+
 
 class MemoryManager:
     """Manages user preference memory blocks for Toph Bot"""
@@ -19,6 +135,10 @@ class MemoryManager:
         self.client = letta_client
         self.agent_id = agent_id
         self.extractor = PreferenceExtractor()
+        self.block_index = BlockIndex(letta_client)
+        # Read-through caches keyed by block label, refreshed on write by update_preference_block
+        self.block_cache = TTLCache()
+        self.preferences_cache = TTLCache()
 
     # =============================================================================
     # LABEL MANAGEMENT
@@ -202,14 +322,16 @@ Please run `@toph-bot/init` to set up your preferences, then I'll be able to hel
         logger.info(f"Looking for preference block with label: {preference_label}")
 
         try:
-            # Try to find existing block
-            existing_blocks = self.client.blocks.list(label=preference_label)
-            logger.info(f"Found {len(existing_blocks)} blocks with label {preference_label}")
-            if existing_blocks:
-                logger.info(f"Returning existing block with ID: {getattr(existing_blocks[0], 'id', 'unknown_id')}")
-                return existing_blocks[0]
+            # Not from the block cache, a cached miss may predate a block another process created
+            existing_block = await asyncio.to_thread(self._get_indexed_block, preference_label)
+            if existing_block:
+                logger.info(f"Returning existing block with ID: {getattr(existing_block, 'id', 'unknown_id')}")
+                self.block_cache.set(preference_label, existing_block)
+                return existing_block
         except Exception as e:
+            # Creating without knowing whether the block exists could duplicate it
             logger.error(f"Error searching for existing block: {str(e)}", exc_info=True)
+            return None
 
         # Create default block if none exists
         logger.info(f"No existing block found, generating default preferences")
@@ -217,11 +339,14 @@ Please run `@toph-bot/init` to set up your preferences, then I'll be able to hel
 
         try:
             logger.info(f"Creating new block with label: {preference_label}")
-            new_block = self.client.blocks.create(
+            new_block = await asyncio.to_thread(
+                self.client.blocks.create,
                 label=preference_label,
                 value=default_preferences,
                 description=f"User preferences for {user_id} in {repo_full_name}"
             )
+            self.block_index.add(new_block)
+            self.block_cache.set(preference_label, new_block)
             logger.info(f"Successfully created new block with ID: {getattr(new_block, 'id', 'unknown_id')}")
             return new_block
         except Exception as e:
@@ -253,42 +378,18 @@ Please run `@toph-bot/init` to set up your preferences, then I'll be able to hel
             )
 
             # Update block value using modify (not update)
-            # updated_block = self.client.blocks.modify(
-            #     agent_id=,
-            #     value=formatted_preferences
-            # )
-            logger.info(f"Listing all blocks to find the right one to update")
-            blocks = self.client.blocks.list()
-            logger.info(f"Found {len(blocks)} total blocks")
-
-            block_found = False
-            for block in blocks:
-                block_name = block.name or ""
-                logger.info(f"Checking block: {block_name} (ID: {getattr(block, 'id', 'unknown')})")
-
-                if block_name.startswith(f"{user_id}_{repo_full_name}"):
-                    block_id = block.id or ""
-                    logger.info(f"Found matching block with ID: {block_id}")
-                    block_found = True
-
-                    logger.info(f"Modifying existing block with ID: {block_id}")
-                    updated_block = self.client.blocks.modify(
-                        block_id=block_id,
-                        value=formatted_preferences
-                    )
-                    logger.info(f"Block successfully modified: {getattr(updated_block, 'id', 'unknown_id')}")
-                    return updated_block
-
-            # make new block if not found
-            if not block_found:
-                logger.info(f"No matching block found, creating new block with name: {user_id}_{repo_full_name}_preferences")
-                new_block = self.client.blocks.create(
-                    value=formatted_preferences,
-                    name=f"{user_id}_{repo_full_name}_preferences",
-                    label="pr_preferences"
-                )
-                logger.info(f"New block created with ID: {getattr(new_block, 'id', 'unknown_id')}")
-                return new_block
+            logger.info(f"Modifying existing block with ID: {block.id}")
+            updated_block = await asyncio.to_thread(
+                self.client.blocks.modify,
+                block_id=block.id,
+                value=formatted_preferences
+            )
+            self.block_index.add(updated_block)
+            preference_label = self._create_preference_label(user_id, repo_full_name)
+            self.block_cache.set(preference_label, updated_block)
+            self.preferences_cache.invalidate(preference_label)
+            logger.info(f"Block successfully modified: {getattr(updated_block, 'id', 'unknown_id')}")
+            return updated_block
 
         except Exception as e:
             logger.error(f"Error updating preference block: {str(e)}", exc_info=True)
@@ -353,11 +454,13 @@ Last updated: {self._get_current_timestamp()}
         codebase_label = self._create_codebase_label(repo_full_name)
 
         try:
-            existing_blocks = self.client.blocks.list(label=codebase_label)
-            if existing_blocks:
-                return existing_blocks[0]
+            existing_block = await asyncio.to_thread(self._get_indexed_block, codebase_label)
+            if existing_block:
+                return existing_block
         except Exception as e:
+            # Creating without knowing whether the block exists could duplicate it
             print(f"Error searching for codebase block: {e}")
+            return None
 
         # Create default codebase block
         default_context = f"""# Codebase Context for {repo_full_name}
@@ -380,11 +483,14 @@ This context block will be automatically updated as I learn more about this code
 """
 
         try:
-            return self.client.blocks.create(
+            new_block = await asyncio.to_thread(
+                self.client.blocks.create,
                 label=codebase_label,
                 value=default_context,
                 description=f"Codebase context and patterns for {repo_full_name}"
             )
+            self.block_index.add(new_block)
+            return new_block
         except Exception as e:
             print(f"Error creating codebase block: {e}")
             return None
@@ -418,12 +524,70 @@ This context block will be automatically updated as I learn more about this code
         preference_label = self._create_preference_label(user_id, repo_full_name)
 
         try:
-            existing_blocks = self.client.blocks.list(label=preference_label)
-            return existing_blocks[0] if existing_blocks else None
+            return await self._get_cached_block(preference_label)
         except Exception as e:
             print(f"Error searching for existing block: {e}")
             return None
 
+    async def get_user_preferences(self, user_id: str, repo_full_name: str) -> Optional[UserPreferences]:
+        """Parsed preferences of a user in a repo, None if they haven't set any"""
+        preference_label = self._create_preference_label(user_id, repo_full_name)
+        preferences = self.preferences_cache.get(preference_label)
+        if preferences is MISSING:
+            block = await self.find_existing_preference_block(user_id, repo_full_name)
+            preferences = self.parse_preference_content(block.value) if block and block.value else None
+            self.preferences_cache.set(preference_label, preferences)
+        return preferences
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss counters of the block and preference caches"""
+        return {"blocks": self.block_cache.stats(), "preferences": self.preferences_cache.stats()}
+
+    async def _get_cached_block(self, label: str):
+        block = self.block_cache.get(label)
+        if block is MISSING:
+            block = await asyncio.to_thread(self._get_indexed_block, label)
+            self.block_cache.set(label, block)
+        return block
+
+    def _get_indexed_block(self, label: str):
+        """
+        Fetch the block with this label, None if it doesn't exist. A label missing from the index is confirmed
+        with a server side lookup, the index may predate the block. Blocking, run it in a worker thread
+        """
+        block_id = self.block_index.get(label)
+        if block_id:
+            return self.client.blocks.retrieve(block_id=block_id)
+        blocks = list(self.client.blocks.list(label=label))
+        if not blocks:
+            return None
+        self.block_index.add(blocks[0])
+        return blocks[0]
+
+    async def get_user_memory(self, user_id: str) -> str:
+        """
+        A user's memory blocks formatted for a prompt, empty if they have none. Sent with each request instead of
+        attached to the shared agent, so requests for different users never wait on each other's blocks
+        """
+        labels = await asyncio.to_thread(self.block_index.user_labels, user_id)
+        blocks = await asyncio.gather(*[self._get_cached_block(label) for label in labels])
+        sections = [f"### {block.label}\n{block.value.strip()}\n" for block in blocks if block and block.value]
+        memory = "\n".join(sections)
+        if len(memory) > USER_MEMORY_MAX_CHARS:
+            memory = memory[:USER_MEMORY_MAX_CHARS] + "\n[memory truncated]\n"
+        return memory
+
+    def detach_managed_blocks(self):
+        """Detach preference and codebase blocks earlier versions attached to the shared agent, keeping its core blocks"""
+        try:
+            blocks = self.client.agents.blocks.list(agent_id=self.agent_id)
+            core = [block.id for block in blocks if not (block.label or "").endswith(MANAGED_LABEL_SUFFIXES)]
+            if len(core) < len(blocks):
+                self.client.agents.modify(agent_id=self.agent_id, block_ids=core)
+                logger.info(f"Detached {len(blocks) - len(core)} memory blocks from the agent")
+        except Exception as e:
+            logger.error(f"Error detaching memory blocks from the agent: {str(e)}", exc_info=True)
+
     def _format_preference_summary(self, preference_block) -> str:
         """Format preference summary for display"""
         if not preference_block or not preference_block.value:
@@ -1,12 +1,21 @@
-from typing import List
+import re
+import math
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
 from letta_client import Letta
-import requests
-from utils.constants import LETTA_API_KEY, AGENT_ID
+import httpx
+from utils.constants import LETTA_API_KEY, AGENT_ID, REVIEW_STREAMING
 
-from github_client import get_installation_access_token
-from .prompts import build_review_prompt, build_pr_comment_prompt
-from .memory_manager import MemoryManager
+from github_client import get_installation_access_token, github_request
+from .prompts import (
+    build_review_prompt, build_pr_comment_prompt_prefix, build_follow_up_prompt,
+    count_tokens, prompt_token_budget, COMMENT_BUDGET_SHARE,
+)
+from .memory_manager import MemoryManager, TTLCache, MISSING
 
 
 
@@ -14,24 +23,108 @@ from .memory_manager import MemoryManager
 client = Letta(token=LETTA_API_KEY)
 memory_manager = MemoryManager(client, AGENT_ID)
 
-def get_user_memory_blocks(user_id: str):
-    memory_blocks = []
-    all_memory_blocks = client.blocks.list()
-    for memory_block in all_memory_blocks:
-        if memory_block.label.startswith(user_id):
-            memory_blocks.append(memory_block)
-    return memory_blocks
+# Push webhooks list at most 2048 commits, a push with more (its "size") falls back to a full sync
+MAX_PUSH_COMMITS = 2048
+
+REVIEW_SYSTEM_PROMPT = (
+    "You are an expert software reviewer. Be precise, pragmatic, and actionable. "
+    "Prefer specific code suggestions over generalities."
+)
+
+# Streamed reviews: placeholder posted up front, then the comment is edited at most this often
+STREAM_UPDATE_INTERVAL = 2.0
+STREAM_PLACEHOLDER = "⏳ Reviewing this pull request..."
+STREAM_IN_PROGRESS = "\n\n_⏳ Review in progress..._"
+# GitHub lists at most 100 changed files per page and 3000 per pull request
+PR_FILES_PER_PAGE = 100
+PR_FILES_MAX_PAGES = 30
+
+# Changed files ranked first in the prompt, see rank_changed_files
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".java", ".kt", ".c", ".cc", ".cpp",
+    ".h", ".hpp", ".cs", ".rb", ".php", ".swift", ".scala", ".sql", ".sh",
+}
+# Lockfiles, vendored and generated files, ranked last
+LOW_SIGNAL_PATH = re.compile(
+    r"(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Cargo\.lock|go\.sum|Gemfile\.lock)$"
+    r"|\.(min\.js|min\.css|map|svg|snap|lock)$"
+    r"|(^|/)(vendor|dist|build|node_modules|__generated__)/"
+)
+# Path fragments that make a file relevant to a user's focus area
+FOCUS_AREA_KEYWORDS = {
+    "security": ("auth", "crypto", "secret", "token", "password", "permission", "session", "login", "acl"),
+    "performance": ("cache", "query", "pool", "worker", "queue", "index", "async", "batch"),
+    "testing": ("test", "spec", "fixture"),
+    "readability": (),
+}
+# Estimated tokens per changed line of a file GitHub shows no diff for, sizes its content before fetching it
+CONTENT_TOKENS_PER_LINE = 10
+
+# Review context retrieved from the Helix codebase index, bounded per review
+REVIEW_CONTEXT_MAX_FILES = 20     # changed files mapped to their indexed entities
+REVIEW_CONTEXT_MAX_ENTITIES = 10  # changed entities used as retrieval queries
+REVIEW_CONTEXT_K = 5              # related entities fetched per changed entity
+# Retrieved context per (repository, PR, head SHA), repeat questions on the same head reuse it
+review_context_cache = TTLCache(maxsize=256, ttl=60 * 60)
+
+
+@dataclass
+class PRContext:
+    """Everything a follow-up question on a PR needs, valid until the PR's next pull_request event"""
+    pr: dict
+    head_sha: str
+    changed_files: List[dict]
+    prompt_prefix: str
+    review: str = ""
+    related_code: List[dict] = field(default_factory=list)
+
+
+# PR contexts keyed by "owner/repo#number", dropped by invalidate_pr_context when the PR changes
+pr_context_cache = TTLCache(maxsize=256, ttl=24 * 60 * 60)
+# Latest head SHA each PR's pull_request events announced, a context built for any other head is stale
+pr_head_shas = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+def pr_context_key(repo_full_name: str, pr_number: int) -> str:
+    return f"{repo_full_name}#{pr_number}"
+
+def invalidate_pr_context(payload: dict):
+    """Forget the cached context of the PR a pull_request event is about (new head, edited title, ...)"""
+    pr_number = payload.get("pull_request", {}).get("number")
+    repo_full_name = payload.get("repository", {}).get("full_name", "")
+    head_sha = payload.get("pull_request", {}).get("head", {}).get("sha")
+    if pr_number:
+        key = pr_context_key(repo_full_name, pr_number)
+        pr_context_cache.invalidate(key)
+        if head_sha:
+            pr_head_shas.set(key, head_sha)
+
+def is_latest_head(key: str, head_sha: str) -> bool:
+    """False once a pull_request event announced a different head for the PR"""
+    return pr_head_shas.get(key, head_sha) == head_sha
+
+def set_pr_context(key: str, context: PRContext):
+    """Cache a PR context unless the PR moved to another head while it was being built"""
+    if is_latest_head(key, context.head_sha):
+        pr_context_cache.set(key, context)
+    else:
+        print(f"   Not caching context of {key} at {context.head_sha[:7]}, the PR has a newer head")
+# Old-side line range of a diff hunk
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@", re.MULTILINE)
+
+# Markdown headings, optionally bolded like the review format's `**### High-Level Summary**`
+SECTION_HEADING = re.compile(r"^\s*\**#{2,6} ", re.MULTILINE)
 
 async def handle_pull_request_event(payload: dict):
     """Handles 'pull_request' events."""
     action = payload.get("action", "")
+    invalidate_pr_context(payload)
     if action in ["opened", "synchronize", "reopened"]:
         print(f"Handling pull_request.{action} event.")
         repo = payload.get("repository", {})
         pr_title = payload.get("pull_request", {}).get("title")
         pr_number = payload.get("pull_request", {}).get("number")
         installation_id = payload.get("installation", {}).get("id")
-        app_token = get_installation_access_token(installation_id)
+        app_token = await get_installation_access_token(installation_id)
         pr_author = payload.get("pull_request", {}).get("user", {}).get("login")
         head_branch = payload.get("pull_request", {}).get("head", {}).get("ref")
         base_branch = payload.get("pull_request", {}).get("base", {}).get("ref")
@@ -40,13 +133,32 @@ async def handle_pull_request_event(payload: dict):
 
 
         # Use review prompt for full PR reviews (not comments)
-        changed_files = fetch_pr_changed_files(owner, repo_name, pr_number, app_token)
-        prompt = build_review_prompt(repo.get("full_name", ""), pr_title, pr_author, head_branch, base_branch, changed_files)
-        response = await handle_pr_event(payload, prompt) # Your existing detailed handler
-        if response:
-            post_pr_comment(owner, repo_name, pr_number, response, app_token)
+        preferences = await memory_manager.get_user_preferences(pr_author, repo.get("full_name", ""))
+        focus_areas = preferences.focus_areas if preferences else ()
+        changed_files = await fetch_pr_changed_files(owner, repo_name, pr_number, app_token, focus_areas=focus_areas)
+        await fetch_undiffed_contents(changed_files, app_token, prompt_token_budget())
+        head_sha = payload.get("pull_request", {}).get("head", {}).get("sha", "")
+        related_code = await get_review_context(owner, repo_name, pr_number, head_sha, changed_files)
+        prompt = build_review_prompt(repo.get("full_name", ""), pr_title, pr_author, head_branch, base_branch, changed_files, related_code=related_code)
+        if REVIEW_STREAMING and changed_files and LETTA_API_KEY:
+            response = await stream_review_comment(owner, repo_name, pr_number, prompt, owner, app_token)
         else:
-            post_pr_comment(owner, repo_name, pr_number, "⚠️ No response generated", app_token)
+            response = await handle_pr_event(payload, prompt, changed_files) # Your existing detailed handler
+            if response:
+                await post_pr_comment(owner, repo_name, pr_number, response, app_token)
+            else:
+                await post_pr_comment(owner, repo_name, pr_number, "⚠️ No response generated", app_token)
+
+        # Follow-up questions on this head reuse the files, prompt and review
+        if changed_files:
+            set_pr_context(pr_context_key(repo["full_name"], pr_number), PRContext(
+                pr=payload["pull_request"],
+                head_sha=head_sha,
+                changed_files=changed_files,
+                prompt_prefix=build_pr_comment_prompt_prefix(repo["full_name"], pr_title, pr_author, head_branch, base_branch, changed_files, related_code),
+                review=response or "",
+                related_code=related_code,
+            ))
     else:
         print(f"Ignored PR action: {action}")
 
@@ -68,12 +180,56 @@ async def handle_push_event(payload: dict):
     ref = payload.get("ref", "")
     if ref == "refs/heads/main":
         print("Handling push to main branch.")
-        # Add your logic here for what to do on a push to main.
-        # For example, trigger a deployment, run tests, etc.
+        owner, repo_name = payload.get("repository", {}).get("full_name", "").split('/')
+        installation_id = payload.get("installation", {}).get("id")
+        commits = payload.get("commits", [])
+        changed_paths, removed_paths = collect_push_paths(commits)
+        full_sync = len(commits) >= MAX_PUSH_COMMITS or payload.get("size", 0) > len(commits)
+
+        if not changed_paths and not removed_paths and not full_sync:
+            print("   No file changes in push, index is up to date")
+            return
+
+        # Runs in a job queue worker, one push job at a time per repository, and is recovered after a crash
+        await refresh_codebase_index(
+            owner, repo_name, installation_id, payload.get("after", "main"),
+            changed_paths, removed_paths, full_sync=full_sync
+        )
     else:
         print(f"Ignored push to ref: {ref}")
 
-async def handle_pr_event(payload, prompt):
+def collect_push_paths(commits: List[dict]):
+    """Fold the added/modified/removed paths of each pushed commit into the final changed and removed sets."""
+    changed_paths, removed_paths = set(), set()
+    for commit in commits:
+        for path in commit.get("added", []) + commit.get("modified", []):
+            changed_paths.add(path)
+            removed_paths.discard(path)
+        for path in commit.get("removed", []):
+            removed_paths.add(path)
+            changed_paths.discard(path)
+    return changed_paths, removed_paths
+
+async def refresh_codebase_index(owner: str, repo_name: str, installation_id: int, ref: str, changed_paths, removed_paths, full_sync: bool = False):
+    """Re-index the files touched by a push against the Helix codebase graph."""
+    try:
+        # Imported lazily, the indexer pulls in tree-sitter, its built grammars and the Helix client
+        from codebase_index import ingestion
+    except Exception as exc:
+        print(f"   ⚠️ Codebase indexer unavailable, {owner}/{repo_name} was not refreshed: {exc!r}")
+        raise
+
+    # Failures propagate, so the job queue records the push job as failed
+    app_token = await get_installation_access_token(installation_id)
+    if full_sync:
+        print(f"   Push to {owner}/{repo_name} lists too many commits, running incremental sync")
+        # Streamed from the archive, nothing is extracted to disk
+        await asyncio.to_thread(ingestion.ingestion, owner, repo_name, app_token, True, True)
+    else:
+        await asyncio.to_thread(ingestion.update_paths, owner, repo_name, changed_paths, removed_paths, app_token, ref)
+    print(f"   ✅ Refreshed codebase index for {owner}/{repo_name}")
+
+async def handle_pr_event(payload, prompt, changed_files):
     """Handle PR opened/updated events from webhooks or the App"""
     pr = payload.get("pull_request")
     if not pr:
@@ -89,14 +245,6 @@ async def handle_pr_event(payload, prompt):
     user_query = payload.get("user_query", "")
     commenter = payload.get("commenter", "")
 
-    installation_id = payload.get("installation", {}).get("id")
-    try:
-        # Generate a temporary token for this specific installation
-        app_token = get_installation_access_token(installation_id)
-    except Exception:
-        print("⚠️ Could not get installation access token: {e}")
-        return
-
     print("\n🔄 PR Event Received:")
     print(f"   Action: {action}")
     print(f"   Repository: {repo['full_name']}")
@@ -108,40 +256,38 @@ async def handle_pr_event(payload, prompt):
         print(f"   User Query: {user_query}")
         print(f"   Commenter: {commenter}")
 
-    # Fetch changed files and patches
-    owner, repo_name = repo['full_name'].split('/')
-    pr_number = pr['number']
-    files = fetch_pr_changed_files(owner, repo_name, pr_number, app_token)
-
-    if not files:
+    owner = repo['full_name'].split('/')[0]
+    # The caller fetched the changed files and built the prompt from them
+    if not changed_files:
         print("   No changed files found or GitHub API access not configured")
         return
 
     # Call Cerebras to get review text
-    review_text = call_letta_agent_for_review(prompt, owner)
+    review_text = await call_letta_agent_for_review(prompt, owner)
 
     if not review_text:
         print("   LLM review skipped (missing credentials or request failed)")
         return
     return review_text
 
-def call_letta_agent_for_review(prompt: str, user_id: str) -> str:
-    """Call Cerebras chat completions and return combined text."""
-    if not
+async def with_user_memory(prompt: str, user_id: str) -> str:
+    """Append the user's memory blocks to a prompt, the shared agent has none of them attached"""
+    memory = await memory_manager.get_user_memory(user_id)
+    return f"{prompt}\n## Memory About {user_id}\n{memory}" if memory else prompt
 
-    system_prompt = (
-        "You are an expert software reviewer. Be precise, pragmatic, and actionable. "
-        "Prefer specific code suggestions over generalities."
-    )
+async def call_letta_agent_for_review(prompt: str, user_id: str) -> str:
+    """Call Cerebras chat completions and return combined text."""
+    if not LETTA_API_KEY:
+        return ""
 
     try:
-        user_memory_blocks = get_user_memory_blocks(user_id)
-        for memory_block in user_memory_blocks:
-            client.agents.blocks.attach(agent_id=AGENT_ID, block_id=memory_block.id)
-        response = client.agents.messages.create(
+        # The user's memory travels in the prompt, the blocking call runs in a worker thread
+        prompt = await with_user_memory(prompt, user_id)
+        response = await asyncio.to_thread(
+            client.agents.messages.create,
             agent_id = AGENT_ID,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ]
         )
@@ -154,51 +300,327 @@ def call_letta_agent_for_review(prompt: str, user_id: str) -> str:
         print(f"   ⚠️ Failed to call Cerebras: {exc}")
         return ""
 
-def post_pr_comment(owner: str, repo_name: str, pr_number: int, body: str, token: str) -> bool:
+def iter_letta_agent_review(prompt: str) -> Iterator[str]:
+    """Stream the agent's answer token by token, yielding text deltas."""
+    stream = client.agents.messages.create_stream(
+        agent_id=AGENT_ID,
+        messages=[
+            {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        stream_tokens=True,
+    )
+    for chunk in stream:
+        if getattr(chunk, "message_type", None) == "assistant_message" and chunk.content:
+            yield chunk.content
+
+async def stream_letta_agent_review(prompt: str, user_id: str) -> AsyncIterator[str]:
+    """Async view of iter_letta_agent_review, the blocking Letta stream is consumed in a worker thread."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for delta in iter_letta_agent_review(prompt):
+                loop.call_soon_threadsafe(queue.put_nowait, delta)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    prompt = await with_user_memory(prompt, user_id)
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while (delta := await queue.get()) is not None:
+            yield delta
+    finally:
+        # Re-raise anything the stream failed with
+        await producer
+
+def completed_sections(text: str) -> str:
+    """Text up to the start of the last heading, the sections before it are complete."""
+    starts = [match.start() for match in SECTION_HEADING.finditer(text)]
+    return text[:starts[-1]].rstrip() if len(starts) > 1 else ""
+
+async def stream_review_comment(owner: str, repo_name: str, pr_number: int, prompt: str, user_id: str, token: str) -> str:
+    """Post a placeholder comment and edit it as review sections complete, then with the full review. Returns the review."""
+    comment_id = await create_pr_comment(owner, repo_name, pr_number, STREAM_PLACEHOLDER, token)
+    if comment_id is None:
+        return ""
+
+    text = ""
+    posted = ""
+    last_update = time.monotonic()
+    try:
+        async for delta in stream_letta_agent_review(prompt, user_id):
+            text += delta
+            completed = completed_sections(text)
+            if len(completed) > len(posted) and time.monotonic() - last_update >= STREAM_UPDATE_INTERVAL:
+                await update_pr_comment(owner, repo_name, comment_id, completed + STREAM_IN_PROGRESS, token)
+                posted = completed
+                last_update = time.monotonic()
+    except Exception as exc:
+        print(f"   ⚠️ Review stream failed: {exc}")
+        text += "\n\n⚠️ The review was interrupted before it finished."
+
+    await update_pr_comment(owner, repo_name, comment_id, text.strip() or "⚠️ No response generated", token)
+    return text.strip()
+
+async def create_pr_comment(owner: str, repo_name: str, pr_number: int, body: str, token: str) -> Optional[int]:
+    """Post a comment to the PR, returning its id for later edits."""
+    url = f"/repos/{owner}/{repo_name}/issues/{pr_number}/comments"
+    try:
+        response = await github_request("POST", url, token, json={"body": body})
+        if response.status_code in (200, 201):
+            return response.json()["id"]
+        print(f"   ⚠️ GitHub API comment error: {response.status_code} {response.text[:200]}")
+    except httpx.HTTPError as exc:
+        print(f"   ⚠️ Failed to post PR comment: {exc}")
+    return None
+
+async def update_pr_comment(owner: str, repo_name: str, comment_id: int, body: str, token: str) -> bool:
+    """Replace the body of a comment posted by create_pr_comment."""
+    url = f"/repos/{owner}/{repo_name}/issues/comments/{comment_id}"
+    try:
+        response = await github_request("PATCH", url, token, json={"body": body})
+        if response.status_code == 200:
+            return True
+        print(f"   ⚠️ GitHub API comment update error: {response.status_code} {response.text[:200]}")
+    except httpx.HTTPError as exc:
+        print(f"   ⚠️ Failed to update PR comment: {exc}")
+    return False
+
+async def post_pr_comment(owner: str, repo_name: str, pr_number: int, body: str, token: str) -> bool:
     """Post a comment to the PR using the Issues comments endpoint. Requires GITHUB_TOKEN."""
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/issues/{pr_number}/comments"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28",
-        "User-Agent": "pr-review-bot",
-    }
+    url = f"/repos/{owner}/{repo_name}/issues/{pr_number}/comments"
     try:
-        response = requests.post(url, headers=headers, json={"body": body}, timeout=30)
+        response = await github_request("POST", url, token, json={"body": body})
         if response.status_code in (200, 201):
             return True
         print(f"   ⚠️ GitHub API comment error: {response.status_code} {response.text[:200]}")
         return False
-    except requests.RequestException as exc:
+    except httpx.HTTPError as exc:
         print(f"   ⚠️ Failed to post PR comment: {exc}")
         return False
 
-def fetch_pr_changed_files(owner: str, repo_name: str, pr_number: int, token: str, max_files: int = 15) -> List[dict]:
-    """Fetch changed files for a PR including patches. Requires GITHUB_TOKEN.
+async def fetch_pr_changed_files(owner: str, repo_name: str, pr_number: int, token: str,
+                                 max_files: Optional[int] = None, focus_areas: Iterable[str] = ()) -> List[dict]:
+    """Fetch every changed file of a PR including patches, most relevant first.
 
-    Returns a list of dicts with keys: filename, status, additions, deletions, changes, patch (optional)
+    The first page tells how many pages there are, the rest are fetched concurrently.
+    Returns a list of dicts with keys: filename, status, additions, deletions, changes, patch (optional), contents_url
     """
 
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/pulls/{pr_number}/files"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28",
-        "User-Agent": "pr-review-bot",
-    }
+    url = f"/repos/{owner}/{repo_name}/pulls/{pr_number}/files"
 
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = await github_request("GET", url, token, params={"per_page": PR_FILES_PER_PAGE, "page": 1})
         if response.status_code != 200:
             print(f"   ⚠️ GitHub API error: {response.status_code} {response.text[:200]}")
             return []
         files = response.json()
-        # Keep it small for prompting
-        return files[:max_files]
-    except requests.RequestException as exc:
+
+        last_page = 1
+        if max_files is None or max_files > PR_FILES_PER_PAGE:
+            last_url = response.links.get("last", {}).get("url")
+            if last_url:
+                last_page = min(int(parse_qs(urlparse(last_url).query)["page"][0]), PR_FILES_MAX_PAGES)
+
+        pages = await asyncio.gather(*[
+            github_request("GET", url, token, params={"per_page": PR_FILES_PER_PAGE, "page": page})
+            for page in range(2, last_page + 1)
+        ])
+        for page in pages:
+            if page.status_code != 200:
+                print(f"   ⚠️ GitHub API error: {page.status_code} {page.text[:200]}")
+                continue
+            files.extend(page.json())
+    except httpx.HTTPError as exc:
         print(f"   ⚠️ Failed to fetch PR files: {exc}")
         return []
 
+    files = rank_changed_files(files, focus_areas)
+    return files[:max_files] if max_files else files
+
+def rank_changed_files(files: List[dict], focus_areas: Iterable[str] = ()) -> List[dict]:
+    """Order changed files by review relevance: source code, focus area matches, then churn."""
+    keywords = [keyword for area in focus_areas for keyword in FOCUS_AREA_KEYWORDS.get(area.strip().lower(), ())]
+
+    def score(file_info: dict) -> float:
+        filename = file_info.get("filename", "").lower()
+        if LOW_SIGNAL_PATH.search(filename):
+            return -1.0
+        value = math.log1p(file_info.get("changes", 0))
+        if "." + filename.rsplit(".", 1)[-1] in SOURCE_EXTENSIONS:
+            value += 5
+        if any(keyword in filename for keyword in keywords):
+            value += 3
+        if file_info.get("status") == "removed":
+            value -= 2
+        return value
+
+    return sorted(files, key=score, reverse=True)
+
+async def fetch_file_content(file_info: dict, token: str) -> Optional[str]:
+    """Fetch the full head content of a changed file on demand, cached on the file dict."""
+    if "content" not in file_info:
+        content = None
+        if file_info.get("status") != "removed" and file_info.get("contents_url"):
+            try:
+                response = await github_request("GET", file_info["contents_url"], token, headers={"Accept": "application/vnd.github.raw"})
+                if response.status_code == 200:
+                    content = response.text
+                else:
+                    print(f"   ⚠️ GitHub API error: {response.status_code} {response.text[:200]}")
+            except httpx.HTTPError as exc:
+                print(f"   ⚠️ Failed to fetch {file_info.get('filename')}: {exc}")
+        file_info["content"] = content
+    return file_info["content"]
+
+async def fetch_undiffed_contents(changed_files: List[dict], token: str, budget: int):
+    """
+    Fetch the head content of source files GitHub shows no diff for, in rank order and only
+    while the diffs and contents before them leave budget, so the prompt can show them whole.
+    """
+    remaining = budget
+    wanted = []
+    for file_info in changed_files:
+        if remaining <= 0:
+            break
+        if file_info.get("patch"):
+            remaining -= count_tokens(file_info["patch"])
+            continue
+        filename = file_info.get("filename", "")
+        if file_info.get("status") == "removed" or "." + filename.rsplit(".", 1)[-1] not in SOURCE_EXTENSIONS:
+            continue
+        # The file is at least as long as the lines it changes
+        needed = file_info.get("changes", 0) * CONTENT_TOKENS_PER_LINE
+        if needed <= remaining:
+            wanted.append(file_info)
+            remaining -= needed
+    await asyncio.gather(*[fetch_file_content(file_info, token) for file_info in wanted])
+
+async def get_pr_context(owner: str, repo_name: str, pr_number: int, pr_url: str, token: str) -> Optional[PRContext]:
+    """Context of a PR for follow-up questions, only read from GitHub when the PR changed since it was built."""
+    key = pr_context_key(f"{owner}/{repo_name}", pr_number)
+    context = pr_context_cache.get(key)
+    if context is not MISSING and is_latest_head(key, context.head_sha):
+        return context
+
+    try:
+        pr_resp = await github_request("GET", pr_url, token)
+        if pr_resp.status_code != 200:
+            print(f"   ⚠️ Failed to fetch PR data: {pr_resp.status_code} {pr_resp.text[:200]}")
+            return None
+        pr_data = pr_resp.json()
+    except httpx.HTTPError as exc:
+        print(f"   ⚠️ Exception fetching PR data: {exc}")
+        return None
+
+    changed_files = await fetch_pr_changed_files(owner, repo_name, pr_number, token)
+    if not changed_files:
+        print("   No changed files found or GitHub API access not configured")
+        return None
+    await fetch_undiffed_contents(changed_files, token, prompt_token_budget(COMMENT_BUDGET_SHARE))
+
+    head_sha = pr_data.get("head", {}).get("sha", "")
+    related_code = await get_review_context(owner, repo_name, pr_number, head_sha, changed_files)
+    context = PRContext(
+        pr=pr_data,
+        head_sha=head_sha,
+        changed_files=changed_files,
+        prompt_prefix=build_pr_comment_prompt_prefix(
+            f"{owner}/{repo_name}", pr_data.get("title", ""), pr_data.get("user", {}).get("login", ""),
+            pr_data.get("head", {}).get("ref", ""), pr_data.get("base", {}).get("ref", ""),
+            changed_files, related_code
+        ),
+        related_code=related_code,
+    )
+    set_pr_context(key, context)
+    return context
+
+async def get_review_context(owner: str, repo_name: str, pr_number: int, head_sha: str, changed_files: List[dict]) -> List[dict]:
+    """Related code for the changed files, retrieved once per head SHA."""
+    key = f"{owner}/{repo_name}#{pr_number}@{head_sha}"
+    related_code = review_context_cache.get(key)
+    if related_code is MISSING:
+        try:
+            related_code = await asyncio.to_thread(retrieve_review_context, owner, repo_name, changed_files)
+        except Exception as exc:
+            # Reviews go ahead on the diff alone, e.g. when the repository was never indexed
+            print(f"   ⚠️ Failed to retrieve codebase context for {owner}/{repo_name}: {exc}")
+            return []
+        review_context_cache.set(key, related_code)
+    return related_code
+
+def retrieve_review_context(owner: str, repo_name: str, changed_files: List[dict]) -> List[dict]:
+    """
+    Map each changed hunk to the indexed entities enclosing it, then collect code related to those
+    entities: hybrid search hits for their signature (callers, similar code) and their neighbours in the file.
+    Returns snippets with keys: entity_id, path, entity_type, text, reason
+    """
+    # Imported lazily, the indexer pulls in tree-sitter, the Helix client and the embedder
+    from codebase_index import ingestion, search
+
+    full_name = f"{owner}/{repo_name}"
+    changed = {}
+    siblings = []
+    for file_info in changed_files[:REVIEW_CONTEXT_MAX_FILES]:
+        path = file_info.get("filename")
+        patch = file_info.get("patch")
+        if not patch or file_info.get("status") == "added":
+            continue
+
+        result = ingestion.client.query("getFileContext", {"repo_path": f"{full_name}/{path}"})[0]
+        if not result.get("file"):
+            continue
+        file = result["file"][0]
+        offsets = line_byte_offsets(search.file_text(file))
+        entities = sorted(result.get("entities", []), key=lambda entity: entity["order"])
+        for entity in entities:
+            entity["text"] = search.entity_text(entity, file)
+
+        for start_line, end_line in hunk_line_ranges(patch):
+            start_byte = offsets[min(start_line, len(offsets)) - 1]
+            end_byte = offsets[min(end_line, len(offsets)) - 1]
+            for index, entity in enumerate(entities):
+                if entity["id"] in changed or entity["start_byte"] >= end_byte or entity["end_byte"] <= start_byte:
+                    continue
+                changed[entity["id"]] = (path, entity)
+                for sibling in entities[max(index - 1, 0):index + 2]:
+                    siblings.append(snippet(sibling["id"], path, sibling, f"next to a changed {entity['entity_type']}"))
+
+    related = []
+    for path, entity in list(changed.values())[:REVIEW_CONTEXT_MAX_ENTITIES]:
+        signature = entity["text"].strip().split("\n", 1)[0]
+        for hit in search.hybrid_search_code(owner, repo_name, signature, k=REVIEW_CONTEXT_K):
+            related.append(snippet(hit["entity_id"], hit["path"], hit, f"related to `{path}`"))
+
+    # Related hits first, they are the likelier callers and look-alikes of the changed code
+    seen = set(changed)
+    snippets = []
+    for candidate in related + siblings:
+        if candidate["entity_id"] not in seen:
+            seen.add(candidate["entity_id"])
+            snippets.append(candidate)
+    return snippets
+
+def snippet(entity_id: str, path: str, entity: dict, reason: str) -> dict:
+    return {"entity_id": entity_id, "path": path, "entity_type": entity.get("entity_type"), "text": entity.get("text", ""), "reason": reason}
+
+def hunk_line_ranges(patch: str) -> List[tuple]:
+    """Base file line ranges [start, end) touched by each hunk of a patch, 1-based."""
+    ranges = []
+    for match in HUNK_HEADER.finditer(patch):
+        start = int(match.group(1))
+        count = int(match.group(2) or 1)
+        ranges.append((max(start, 1), max(start, 1) + max(count, 1)))
+    return ranges
+
+def line_byte_offsets(text: str) -> List[int]:
+    """Byte offset of the start of every line, entity offsets are utf-8 byte offsets."""
+    offsets = [0]
+    for line in text.encode("utf8").splitlines(keepends=True):
+        offsets.append(offsets[-1] + len(line))
+    return offsets
 
 def truncate_text(text: str, max_chars: int) -> str:
     if len(text) <= max_chars:
@@ -236,10 +658,34 @@ async def handle_installation_event(payload):
     elif action == "unsuspend":
         print(f"  ▶️ App unsuspended")
 
+async def answer_pr_question(payload: dict, app_token: str) -> Optional[str]:
+    """Answer a @toph-bot question on a PR from its cached context and review"""
+    issue = payload.get("issue", {})
+    repository = payload.get("repository", {})
+    pr_url = issue.get("pull_request", {}).get("url")
+    if not pr_url:
+        return None
+
+    comment_body = payload.get("comment", {}).get("body", "")
+    commenter = payload.get("comment", {}).get("user", {}).get("login", "user")
+    user_query = re.sub(r"@toph(-bot)?", "", comment_body, flags=re.IGNORECASE).strip()
+    if not user_query:
+        user_query = "Please provide information about this PR."
+
+    owner = repository.get("owner", {}).get("login", "")
+    repo_name = repository.get("name", "")
+    pr_number = issue.get("number")
+    context = await get_pr_context(owner, repo_name, pr_number, pr_url, app_token)
+    if not context:
+        return None
+
+    print(f"   Answering {commenter} on {owner}/{repo_name}#{pr_number} at {context.head_sha[:7]}")
+    prompt = build_follow_up_prompt(context.prompt_prefix, user_query, context.review)
+    return await call_letta_agent_for_review(prompt, owner) or None
+
 async def command_router(payload, command):
     installation_id = payload.get("installation", {}).get("id")
-    app_token       = get_installation_access_token(installation_id)
-    response        = await memory_manager.handle_init_command(payload)
+    app_token       = await get_installation_access_token(installation_id)
     owner           = payload.get("repository", {}).get("owner", {}).get("login")
     repo_name       = payload.get("repository", {}).get("name")
     response        = None
@@ -249,64 +695,14 @@ async def command_router(payload, command):
         case "configure":
             response = await memory_manager.handle_configure_command(payload)
         case "interact":
+            # Users without preferences are pointed at @toph-bot/init, everyone else gets an answer
             response = await memory_manager.handle_interaction_command(payload)
-        case _:
-            issue = payload.get("issue", {})
-            repository = payload.get("repository", {})
-            pr_title = payload.get("title", "")
-            pr_author = payload.get("user", {}).get("login", "")
-            head_branch = payload.get("head", {}).get("ref", "")
-            base_branch = payload.get("base", {}).get("ref", "")
-            pr_url = issue.get("pull_request", {}).get("url")
-            comment_body = payload.get("comment", {}).get("body", "")
-            if pr_url and comment_body.startswith("@toph-bot"):
-                commenter = payload.get("comment", {}).get("user", {}).get("login", "user")
-                user_query = comment_body.replace("@toph-bot", "").replace("@Toph", "").strip()
-                if not user_query:
-                    user_query = "Please provide information about this PR."
-
-                # Fetch the full PR object so handle_pr_event has the 'pull_request' key it needs
-                headers = {
-                    "Authorization": f"Bearer {app_token}",
-                    "Accept": "application/vnd.github+json",
-                    "X-GitHub-Api-Version": "2022-11-28",
-                    "User-Agent": "pr-review-bot",
-                }
-                try:
-                    pr_resp = requests.get(pr_url, headers=headers, timeout=30)
-                    if pr_resp.status_code != 200:
-                        print(f"   ⚠️ Failed to fetch PR data: {pr_resp.status_code} {pr_resp.text[:200]}")
-                        return
-                    pr_data = pr_resp.json()
-                except requests.RequestException as exc:
-                    print(f"   ⚠️ Exception fetching PR data: {exc}")
-                    return
-
-                # Create a payload structure similar to a pull_request event
-                pr_payload = {
-                    "action": "commented",
-                    "pull_request": pr_data,
-                    "repository": repository,
-                    "installation": payload.get("installation"),
-                    "user_query": user_query,
-                    "commenter": commenter
-                }
-
-                # Fetch changed files first
-                owner = repository.get("owner", {}).get("login", "")
-                repo_name = repository.get("name", "")
-                pr_number = issue.get("number")
-                installation_id = payload.get("installation", {}).get("id")
-                app_token = get_installation_access_token(installation_id)
-                changed_files = fetch_pr_changed_files(owner, repo_name, pr_number, app_token)
-
-                repo_full_name = repository.get("full_name", "")
-                prompt = build_pr_comment_prompt(repo_full_name, pr_title, pr_author, head_branch, base_branch, changed_files, user_query)
-                response = await handle_pr_event(pr_payload, prompt)
+            if response is None:
+                response = await answer_pr_question(payload, app_token)
 
     issue_number = payload.get("issue", {}).get("number")
     if issue_number and response is not None:
-        posted = post_pr_comment(owner, repo_name, issue_number, response, app_token)
+        posted = await post_pr_comment(owner, repo_name, issue_number, response, app_token)
         if posted:
             print("✅ Posted initialization response")
         else:
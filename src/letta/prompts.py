@@ -1,4 +1,18 @@
-from typing import List
+from typing import List, Optional, Tuple
+from utils.constants import CEREBRAS_CONTEXT_TOKENS, CEREBRAS_MAX_TOKENS
+
+# Tokens left for the Letta agent's own system prompt, memory blocks and message history
+AGENT_OVERHEAD_TOKENS = 8_000
+# Share of the prompt budget a conversational comment may use, answers need far less context than reviews
+COMMENT_BUDGET_SHARE = 0.5
+# Share of the prompt budget reserved for related code retrieved from the codebase index
+RELATED_CODE_BUDGET_SHARE = 0.2
+# Tokens a cached comment prompt prefix leaves free for the follow-up question and the previous review
+FOLLOW_UP_RESERVE_TOKENS = CEREBRAS_MAX_TOKENS + 1_000
+# Omitted files are listed one per line up to this many, the rest are only counted
+MAX_OMITTED_LISTED = 50
+
+_encoding = None
 
 # Review prompt instructions
 REVIEW_INSTRUCTIONS = """
@@ -72,97 +86,211 @@ def get_random_irrelevant_response() -> str:
     import random
     return random.choice(IRRELEVANT_RESPONSES)
 
-def build_review_prompt(
-    repository_full_name: str,
-    pr_title: str,
-    pr_author: str,
-    head_branch: str,
-    base_branch: str,
-    changed_files: List[dict],
-    max_total_patch_chars: int = 30_000,
-) -> str:
-    """Construct a context-rich prompt for PR review."""
-    header = (
-        f"Repository: {repository_full_name}\n"
-        f"PR Title: {pr_title}\n"
-        f"Author: {pr_author}\n"
-        f"Branches: {head_branch} -> {base_branch}\n"
-        f"Files changed: {len(changed_files)}\n\n"
+def count_tokens(text: str) -> int:
+    """Count tokens with the model's tokenizer, estimating about 4 characters per token without tiktoken."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            # gpt-oss uses the o200k vocabulary
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def prompt_token_budget(share: float = 1.0) -> int:
+    """Tokens a prompt may use: the context window minus the reply and the agent's overhead."""
+    return int((CEREBRAS_CONTEXT_TOKENS - CEREBRAS_MAX_TOKENS - AGENT_OVERHEAD_TOKENS) * share)
+
+def split_hunks(patch: str) -> List[str]:
+    """Split a unified diff patch into its @@ hunks."""
+    hunks: List[str] = []
+    for line in patch.splitlines(keepends=True):
+        if line.startswith("@@") or not hunks:
+            hunks.append(line)
+        else:
+            hunks[-1] += line
+    return hunks
+
+def summarize_file(file_info: dict, reason: str) -> str:
+    filename = file_info.get("filename", "<unknown>")
+    status = file_info.get("status", "modified")
+    return f"- `{filename}` ({status}, +{file_info.get('additions', 0)}/-{file_info.get('deletions', 0)}): {reason}\n"
+
+def format_file_diff(filename: str, hunks: List[str], omitted_hunks: int = 0) -> str:
+    diff = "".join(hunks).rstrip("\n")
+    note = f"[{omitted_hunks} more hunks omitted]\n" if omitted_hunks else ""
+    return f"### File: `{filename}`\n```diff\n{diff}\n```\n{note}"
+
+def pack_changed_files(changed_files: List[dict], budget: int) -> Tuple[List[str], List[str]]:
+    """
+    Fit file diffs into `budget` tokens, in the order given (most relevant first).
+    Files that don't fit whole keep the hunks that do, whole hunks only. Returns the
+    diff sections and a one-line summary for every file left out.
+    """
+    summary_reserve = sum(
+        count_tokens(summarize_file(file_info, "omitted, prompt budget exhausted"))
+        for file_info in changed_files[:MAX_OMITTED_LISTED]
     )
+    remaining = budget - summary_reserve
 
-    parts: List[str] = [header, "## Code Changes Context\n"]
-    accumulated = 0
+    sections: List[str] = []
+    omitted: List[str] = []
     for file_info in changed_files:
         filename = file_info.get("filename", "<unknown>")
         patch = file_info.get("patch", "")
         if not patch:
-            continue # Skip files with no diff content (e.g., binary files)
+            # Binary files, and diffs too large for GitHub to render. The head content stands in when it was fetched and fits
+            content = file_info.get("content")
+            section = format_file_content(filename, content) if content else ""
+            tokens = count_tokens(section)
+            if not section or tokens > remaining:
+                omitted.append(summarize_file(file_info, "no diff available"))
+                continue
+            sections.append(section)
+            remaining -= tokens
+            continue
 
-        file_header = f"### File: `{filename}`\n```diff\n{patch}\n```\n"
+        hunks = split_hunks(patch)
+        section = format_file_diff(filename, hunks)
+        tokens = count_tokens(section)
+        if tokens > remaining:
+            # Keep the hunks that fit, skipping larger ones so smaller later hunks still get in
+            kept: List[str] = []
+            kept_tokens = count_tokens(format_file_diff(filename, [], len(hunks)))
+            for hunk in hunks:
+                hunk_tokens = count_tokens(hunk)
+                if kept_tokens + hunk_tokens <= remaining:
+                    kept.append(hunk)
+                    kept_tokens += hunk_tokens
+            if not kept:
+                omitted.append(summarize_file(file_info, "omitted, prompt budget exhausted"))
+                continue
+            section = format_file_diff(filename, kept, len(hunks) - len(kept))
+            tokens = count_tokens(section)
 
-        # Truncate the patch if it's too long to avoid exhausting the budget on one file
-        remaining = max_total_patch_chars - accumulated
-        if remaining <= 0:
-            parts.append("\n[Context budget exhausted, subsequent files omitted.]\n")
-            break
+        sections.append(section)
+        remaining -= tokens
 
-        if len(file_header) > remaining:
-            # A simplified truncation for the oversized patch
-            truncated_patch = patch[:remaining - 150] + "\n... (truncated)\n"
-            file_header = f"### File: `{filename}`\n```diff\n{truncated_patch}\n```\n"
+    if len(omitted) > MAX_OMITTED_LISTED:
+        omitted = omitted[:MAX_OMITTED_LISTED] + [f"- ...and {len(omitted) - MAX_OMITTED_LISTED} more files\n"]
+    return sections, omitted
 
-        parts.append(file_header)
-        accumulated += len(file_header)
 
-    parts.append(REVIEW_INSTRUCTIONS)
-    return "".join(parts)
+def format_file_content(filename: str, content: str) -> str:
+    return f"### File: `{filename}` (no diff available, full content)\n```\n{content.rstrip()}\n```\n"
 
-def build_pr_comment_prompt(
+
+def pack_related_code(related_code: List[dict], budget: int) -> List[str]:
+    """Fit retrieved snippets into `budget` tokens, most relevant first, skipping any that don't fit whole."""
+    sections: List[str] = []
+    remaining = budget
+    for snippet in related_code:
+        section = (
+            f"### `{snippet.get('path')}` ({snippet.get('entity_type')}, {snippet.get('reason')})\n"
+            f"```\n{snippet.get('text', '').rstrip()}\n```\n"
+        )
+        tokens = count_tokens(section)
+        if tokens <= remaining:
+            sections.append(section)
+            remaining -= tokens
+    return sections
+
+def build_prompt(
     repository_full_name: str,
     pr_title: str,
     pr_author: str,
     head_branch: str,
     base_branch: str,
     changed_files: List[dict],
-    user_query: str = "",
-    max_total_patch_chars: int = 15_000,  # Smaller for comments
-):
+    context_title: str,
+    instructions: str,
+    max_prompt_tokens: int,
+    suffix: str = "",
+    related_code: List[dict] = (),
+) -> str:
+    """Header, as many diffs as the token budget allows, omitted file summaries, related code, then the instructions."""
     header = (
         f"Repository: {repository_full_name}\n"
         f"PR Title: {pr_title}\n"
         f"Author: {pr_author}\n"
         f"Branches: {head_branch} -> {base_branch}\n"
         f"Files changed: {len(changed_files)}\n\n"
+        f"{context_title}\n"
     )
+    budget = max_prompt_tokens - count_tokens(header) - count_tokens(instructions) - count_tokens(suffix)
+    related = pack_related_code(related_code, int(budget * RELATED_CODE_BUDGET_SHARE)) if related_code else []
+    sections, omitted = pack_changed_files(changed_files, budget - sum(count_tokens(section) for section in related))
 
-    parts: List[str] = [header, "## Code Diff Context\n"]
-    accumulated = 0
-    for file_info in changed_files:
-        filename = file_info.get("filename", "<unknown>")
-        patch = file_info.get("patch", "")
-        if not patch:
-            continue # Skip files with no diff content (e.g., binary files)
-
-        file_header = f"### File: `{filename}`\n```diff\n{patch}\n```\n"
-
-        # Truncate the patch if it's too long to avoid exhausting the budget on one file
-        remaining = max_total_patch_chars - accumulated
-        if remaining <= 0:
-            parts.append("\n[Diff budget exhausted, subsequent files omitted.]\n")
-            break
-
-        if len(file_header) > remaining:
-            # A simplified truncation for the oversized patch
-            truncated_patch = patch[:remaining - 150] + "\n... (truncated)\n"
-            file_header = f"### File: `{filename}`\n```diff\n{truncated_patch}\n```\n"
-
-        parts.append(file_header)
-        accumulated += len(file_header)
+    parts: List[str] = [header, *sections]
+    if omitted:
+        parts.append("\n### Files not shown\n")
+        parts.extend(omitted)
+    if related:
+        parts.append("\n## Related Code From The Codebase\n")
+        parts.extend(related)
+    parts.append(instructions)
+    parts.append(suffix)
+    return "".join(parts)
 
-    parts.append(COMMENT_INSTRUCTIONS)
+def build_review_prompt(
+    repository_full_name: str,
+    pr_title: str,
+    pr_author: str,
+    head_branch: str,
+    base_branch: str,
+    changed_files: List[dict],
+    max_prompt_tokens: Optional[int] = None,
+    related_code: List[dict] = (),
+) -> str:
+    """Construct a context-rich prompt for PR review."""
+    return build_prompt(
+        repository_full_name, pr_title, pr_author, head_branch, base_branch, changed_files,
+        "## Code Changes Context", REVIEW_INSTRUCTIONS,
+        max_prompt_tokens or prompt_token_budget(), related_code=related_code,
+    )
 
+def build_pr_comment_prompt(
+    repository_full_name: str,
+    pr_title: str,
+    pr_author: str,
+    head_branch: str,
+    base_branch: str,
+    changed_files: List[dict],
+    user_query: str = "",
+    max_prompt_tokens: Optional[int] = None,  # Smaller for comments
+    related_code: List[dict] = (),
+):
     # Add the user's specific question
-    if user_query:
-        parts.append(f"\n## User Question:\n{user_query}\n")
+    suffix = f"\n## User Question:\n{user_query}\n" if user_query else ""
+    return build_prompt(
+        repository_full_name, pr_title, pr_author, head_branch, base_branch, changed_files,
+        "## Code Diff Context", COMMENT_INSTRUCTIONS,
+        max_prompt_tokens or prompt_token_budget(COMMENT_BUDGET_SHARE), suffix, related_code,
+    )
+
+def build_pr_comment_prompt_prefix(
+    repository_full_name: str,
+    pr_title: str,
+    pr_author: str,
+    head_branch: str,
+    base_branch: str,
+    changed_files: List[dict],
+    related_code: List[dict] = (),
+) -> str:
+    """Comment prompt without the question, cached per PR head and completed by build_follow_up_prompt."""
+    return build_pr_comment_prompt(
+        repository_full_name, pr_title, pr_author, head_branch, base_branch, changed_files,
+        max_prompt_tokens=prompt_token_budget(COMMENT_BUDGET_SHARE) - FOLLOW_UP_RESERVE_TOKENS,
+        related_code=related_code,
+    )
 
+def build_follow_up_prompt(prompt_prefix: str, user_query: str, previous_review: str = "") -> str:
+    """Complete a cached comment prompt prefix with the previous review and the user's question."""
+    parts = [prompt_prefix]
+    if previous_review:
+        parts.append(f"\n## Your Previous Review Of This PR:\n{previous_review}\n")
+    parts.append(f"\n## User Question:\n{user_query}\n")
     return "".join(parts)
@@ -6,10 +6,17 @@ load_dotenv()
 CEREBRAS_API_KEY      = os.getenv("CEREBRAS_API_KEY", "")
 CEREBRAS_MODEL        = os.getenv("CEREBRAS_MODEL", "gpt-oss-120b")
 CEREBRAS_MAX_TOKENS   = int(os.getenv("CEREBRAS_MAX_TOKENS", "2048"))
+CEREBRAS_CONTEXT_TOKENS = int(os.getenv("CEREBRAS_CONTEXT_TOKENS", "65536"))
 
 LETTA_API_KEY         = os.getenv("LETTA_API_KEY")
 AGENT_ID              = "agent-72b0ecc4-bd82-4776-880c-33a24b41f13e"
+REVIEW_STREAMING      = os.getenv("REVIEW_STREAMING", "true").lower() == "true"
 
 GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
 GITHUB_APP_ID         = os.getenv("GITHUB_APP_ID")
 GITHUB_PRIVATE_KEY    = os.getenv("GITHUB_PRIVATE_KEY")
+
+JOB_QUEUE_PATH        = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+JOB_QUEUE_WORKERS     = int(os.getenv("JOB_QUEUE_WORKERS", "4"))
+JOB_QUEUE_MAX_PER_KEY = int(os.getenv("JOB_QUEUE_MAX_PER_KEY", "1"))
+REVIEW_COALESCE_WINDOW = float(os.getenv("REVIEW_COALESCE_WINDOW", "15"))
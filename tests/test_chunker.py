@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from codebase_index.chunker import chunk_entity, pack_units, split_entity, split_lines
+
+
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+class Source:
+    """Stand-in for parsing.SourceBuffer, which needs tree-sitter to import"""
+    def __init__(self, source_code: bytes):
+        self.view = memoryview(source_code)
+
+    def text(self, start_byte: int, end_byte: int) -> str:
+        return bytes(self.view[start_byte:end_byte]).decode('utf8')
+
+
+class Entity:
+    def __init__(self, source, start_byte, end_byte, children=()):
+        self.source = source
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+        self.children = list(children)
+
+    @property
+    def text(self) -> str:
+        return self.source.text(self.start_byte, self.end_byte)
+
+
+def statements(source_code: bytes, source: Source) -> list:
+    """One child entity per line, like the statements of a function body"""
+    children = []
+    start = 0
+    for line in source_code.splitlines(keepends=True):
+        children.append(Entity(source, start, start + len(line)))
+        start += len(line)
+    return children
+
+
+def function(lines: list) -> Entity:
+    source_code = ''.join(lines).encode()
+    source = Source(source_code)
+    return Entity(source, 0, len(source_code), statements(source_code, source))
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(8, 0), (8, 3), (10, 5), (4, 4)])
+def test_chunks_fit_budget_and_overlap(max_tokens, overlap):
+    entity = function([f"stmt{i} " + "word " * (i % 4) + "\n" for i in range(40)])
+    units = split_entity(entity, count_tokens, max_tokens)
+    chunks = pack_units(units, max_tokens, overlap)
+
+    assert len(chunks) > 1
+    for start, end in chunks:
+        assert count_tokens(entity.source.text(start, end)) <= max_tokens
+    for (_, previous_end), (start, _) in zip(chunks, chunks[1:]):
+        shared = entity.source.text(start, previous_end) if start < previous_end else ''
+        assert count_tokens(shared) <= overlap
+    # Every unit ends up in a chunk, in order
+    assert chunks[0][0] == units[0][0] and chunks[-1][1] == units[-1][1]
+    assert all(a[1] <= b[1] for a, b in zip(chunks, chunks[1:]))
+
+
+def test_overlap_carries_trailing_units():
+    units = [(0, 1, 2), (1, 2, 2), (2, 3, 2), (3, 4, 2)]
+    assert pack_units(units, 4, 0) == [(0, 2), (2, 4)]
+    assert pack_units(units, 4, 2) == [(0, 2), (1, 3), (2, 4)]
+    # Overlap never pushes the next chunk over budget
+    assert pack_units([(0, 1, 2), (1, 2, 3)], 4, 2) == [(0, 1), (1, 2)]
+
+
+def test_large_leaf_falls_back_to_lines():
+    body = ''.join(f"line {i} a b c\n" for i in range(12))
+    source_code = f"def f():\n{body}".encode()
+    source = Source(source_code)
+    header = len(b"def f():\n")
+    # The body is a single leaf child over budget, it is split on its lines
+    entity = Entity(source, 0, len(source_code), [Entity(source, 0, header), Entity(source, header, len(source_code))])
+
+    units = split_entity(entity, count_tokens, 12)
+    assert units[0] == (0, header, 2)
+    assert [source.text(start, end) for start, end, _ in units[1:]] == body.splitlines(keepends=True)
+    assert all(tokens == 5 for _, _, tokens in units[1:])
+
+    chunks = chunk_entity(entity, count_tokens, 12, 5)
+    assert all(count_tokens(chunk) <= 12 for chunk in chunks)
+    assert all(f"line {i} " in ''.join(chunks) for i in range(12))
+
+
+def test_split_lines_skips_blank_lines_and_replaces_invalid_utf8():
+    source = Source(b"a b\n\n   \n\xff c\n")
+    assert split_lines(source, 0, len(source.view), count_tokens) == [(0, 4, 2), (9, 13, 2)]
+
+
+def test_whitespace_only_entity_has_no_chunks():
+    source = Source(b"  \n\t\n   ")
+    assert chunk_entity(Entity(source, 0, len(source.view)), count_tokens, 8) == []
+
+
+def test_small_entity_is_one_chunk():
+    entity = function(["def f():\n", "    return 1\n"])
+    assert chunk_entity(entity, count_tokens, 8) == [entity.text]
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, os.path.join(SRC, 'fastapi'))
+sys.path.insert(1, SRC)
+import github_client
+from github_client import InstallationTokenCache
+
+
+def token_response(token: str, expires_in: float) -> httpx.Response:
+    expires_at = datetime.fromtimestamp(time.time() + expires_in, timezone.utc).isoformat().replace("+00:00", "Z")
+    request = httpx.Request("POST", "https://api.github.com/app/installations/1/access_tokens")
+    return httpx.Response(201, json={"token": token, "expires_at": expires_at}, request=request)
+
+
+class FakeMint:
+    """Stands in for github_request on the access_tokens endpoint, counting mints"""
+    def __init__(self, expires_in: float = 3600, delay: float = 0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.mints = 0
+
+    async def __call__(self, method, url, token, **kwargs):
+        assert url == "/app/installations/1/access_tokens" and token == "app-jwt"
+        self.mints += 1
+        await asyncio.sleep(self.delay)
+        return token_response(f"token-{self.mints}", self.expires_in)
+
+
+def install(monkeypatch, cache, mint=None):
+    monkeypatch.setattr(github_client, "token_cache", cache)
+    monkeypatch.setattr(github_client, "get_github_app_jwt", lambda: "app-jwt")
+    if mint is not None:
+        monkeypatch.setattr(github_client, "github_request", mint)
+
+
+def test_concurrent_gets_share_one_mint(monkeypatch):
+    async def run():
+        cache = InstallationTokenCache()
+        mint = FakeMint(delay=0.05)
+        install(monkeypatch, cache, mint)
+        tokens = await asyncio.gather(*(cache.get(1) for _ in range(10)))
+        cached = await cache.get(1)
+        cache.close()
+        return tokens, cached, mint.mints
+
+    tokens, cached, mints = asyncio.run(run())
+    assert tokens == ["token-1"] * 10
+    assert cached == "token-1"
+    assert mints == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_mint(monkeypatch):
+    async def run():
+        cache = InstallationTokenCache()
+        mint = FakeMint(delay=0.05)
+        install(monkeypatch, cache, mint)
+        first = asyncio.create_task(cache.get(1))
+        second = asyncio.create_task(cache.get(1))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        token = await second
+        cache.close()
+        return token, mint.mints
+
+    assert asyncio.run(run()) == ("token-1", 1)
+
+
+def test_token_inside_refresh_margin_is_renewed(monkeypatch):
+    async def run():
+        cache = InstallationTokenCache(refresh_margin=600)
+        mint = FakeMint(expires_in=300)
+        install(monkeypatch, cache, mint)
+        first = await cache.get(1)
+        second = await cache.get(1)
+        cache.close()
+        return first, second
+
+    assert asyncio.run(run()) == ("token-1", "token-2")
+
+
+def test_only_used_tokens_are_renewed_in_the_background(monkeypatch):
+    async def run():
+        cache = InstallationTokenCache(refresh_margin=600)
+        mint = FakeMint(expires_in=600.05)
+        install(monkeypatch, cache, mint)
+
+        # Idle since it was minted, the renewal lets it lapse
+        await cache.get(1)
+        await asyncio.sleep(0.2)
+        idle_mints = mint.mints
+
+        # Used again, the renewal mints ahead of expiry
+        cache.invalidate(1)
+        await cache.get(1)
+        await cache.get(1)
+        await asyncio.sleep(0.2)
+        cache.close()
+        return idle_mints, mint.mints, cache._tokens[1][0]
+
+    idle_mints, mints, token = asyncio.run(run())
+    assert idle_mints == 1
+    assert mints == 3
+    assert token == "token-3"
+
+
+def test_401_invalidates_and_retries_once(monkeypatch):
+    async def run():
+        cache = InstallationTokenCache()
+        install(monkeypatch, cache)
+        mints = []
+        sent = []
+
+        class FakeClient:
+            async def request(self, method, url, headers=None, **kwargs):
+                token = headers["Authorization"].removeprefix("Bearer ")
+                if url.endswith("/access_tokens"):
+                    mints.append(token)
+                    return token_response(f"token-{len(mints)}", 3600)
+                sent.append(token)
+                status = 401 if token in ("token-1", "app-jwt") else 200
+                return httpx.Response(status, request=httpx.Request(method, "https://api.github.com" + url))
+
+        monkeypatch.setattr(github_client, "get_http_client", lambda: FakeClient())
+        token = await cache.get(1)
+        response = await github_client.github_request("GET", "/repos/owner/repo", token)
+        # A 401 for a token the cache didn't mint (an app JWT) is returned as is
+        jwt_response = await github_client.github_request("GET", "/repos/owner/repo", "app-jwt")
+        cache.close()
+        return response.status_code, jwt_response.status_code, mints, sent, cache._tokens[1][0]
+
+    status, jwt_status, mints, sent, cached = asyncio.run(run())
+    assert status == 200
+    assert jwt_status == 401
+    assert mints == ["app-jwt", "app-jwt"]
+    assert sent == ["token-1", "token-2", "app-jwt"]
+    assert cached == "token-2"
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pathspec
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from codebase_index.ignore_rules import compile_ignore_rules, IgnoreMatcher, RepoIgnoreRules
+
+PATHS = [
+    "main.py", "app.log", "keep.log", "logs/app.log", "logs/keep.log",
+    "build", "build/out.py", "src/build", "src/build/out.py", "docs/build.py",
+    "root.py", "src/root.py", "docs/guide.md", "docs/api/guide.md", "src/docs/guide.md",
+    "node_modules/pkg/index.js", "a/b/node_modules/x.js", "tmp", "src/tmp/cache.py",
+]
+
+RULE_SETS = {
+    "negation after ignore": ["*.log", "!keep.log"],
+    "ignore after negation": ["!keep.log", "*.log"],
+    "negation inside ignored dir": ["logs/", "!logs/keep.log"],
+    "anchored": ["/root.py", "/build"],
+    "slash anchors": ["docs/*.md"],
+    "unanchored dir": ["build/", "node_modules/"],
+    "double star": ["**/node_modules", "docs/**/guide.md"],
+    "file or dir": ["tmp"],
+    "comments and blanks": ["# comment", "", "*.py", "!main.py"],
+}
+
+
+@pytest.mark.parametrize("lines", list(RULE_SETS.values()), ids=list(RULE_SETS))
+def test_matches_pathspec(lines):
+    """Files and directories are ignored exactly when pathspec matches them"""
+    matcher = IgnoreMatcher('', compile_ignore_rules(lines))
+    spec = pathspec.PathSpec.from_lines('gitwildmatch', lines)
+    for path in PATHS:
+        assert matcher.is_ignored(path) == spec.match_file(path), path
+        assert matcher.is_ignored(path, True) == spec.match_file(path + '/'), path + '/'
+
+
+def test_directory_only_rule_skips_files():
+    matcher = IgnoreMatcher('', compile_ignore_rules(["build/"]))
+    assert matcher.is_ignored("build", True)
+    assert not matcher.is_ignored("build")
+
+
+def test_deepest_level_decides():
+    """A subdirectory's .gitignore overrides its parents, for paths relative to it"""
+    root = IgnoreMatcher('', compile_ignore_rules(["*.log"]))
+    sub = root.for_directory("sub", ["!keep.log", "/local.py"])
+    assert sub.is_ignored("sub/app.log")
+    assert not sub.is_ignored("sub/keep.log")
+    assert sub.is_ignored("sub/local.py")
+    assert not sub.is_ignored("sub/deeper/local.py")
+    assert root.for_directory("other", []) is root
+
+
+def test_absolute_paths():
+    root = IgnoreMatcher('/repo', compile_ignore_rules(["/build"]))
+    assert root.is_ignored("/repo/build", True)
+    assert not root.is_ignored("/repo/src/build", True)
+
+
+def test_repo_rules_apply_nested_gitignores():
+    """Paths outside a tree on disk get the same answer as scan_directory"""
+    gitignores = {'': ["*.log", "generated/"], 'src': ["!keep.log", "/local.py"]}
+    fetched = []
+
+    def gitignore_lines(rel_dir):
+        fetched.append(rel_dir)
+        return gitignores.get(rel_dir, [])
+
+    rules = RepoIgnoreRules(['.git/'], gitignore_lines)
+    assert rules.is_ignored("app.log")
+    assert not rules.is_ignored("src/keep.log")
+    assert rules.is_ignored("src/local.py")
+    assert not rules.is_ignored("src/deeper/local.py")
+    assert rules.is_ignored("generated/api.py")
+    assert rules.is_ignored("src/generated/deeper/api.py")
+    assert rules.is_ignored(".git/hooks/pre-commit.py")
+    assert not rules.is_ignored("src/main.py")
+    assert sorted(set(fetched)) == sorted(fetched)
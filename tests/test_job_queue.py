@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'fastapi'))
+from job_queue import JobQueue
+
+PR_EVENT = {"repository": {"full_name": "owner/repo"}, "pull_request": {"number": 1}}
+
+
+def pr_event(sha: str) -> dict:
+    return {**PR_EVENT, "pull_request": {"number": 1, "head": {"sha": sha}}}
+
+
+async def wait_for(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_newer_coalescing_job_supersedes_waiting_one(tmp_path):
+    async def run():
+        ran = []
+
+        async def handler(payload):
+            ran.append(payload["pull_request"]["head"]["sha"])
+
+        queue = JobQueue({"pull_request": handler}, str(tmp_path / "jobs.db"), coalesce_window=0.05)
+        queue.start()
+        first = queue.enqueue("pull_request", pr_event("a"), coalesce=True)
+        second = queue.enqueue("pull_request", pr_event("b"), coalesce=True)
+        await wait_for(lambda: queue.status(second)["status"] == "done")
+        await asyncio.sleep(0.1)
+        status = queue.status(first)["status"]
+        await queue.stop()
+        return ran, status
+
+    ran, status = asyncio.run(run())
+    assert ran == ["b"]
+    assert status == "superseded"
+
+
+def test_busy_key_parks_jobs_in_order(tmp_path):
+    async def run():
+        ran = []
+        release = asyncio.Event()
+
+        async def handler(payload):
+            ran.append(payload["pull_request"]["head"]["sha"])
+            if payload["pull_request"]["head"]["sha"] == "a":
+                await release.wait()
+
+        queue = JobQueue({"pull_request": handler}, str(tmp_path / "jobs.db"), workers=3)
+        queue.start()
+        jobs = [queue.enqueue("pull_request", pr_event(sha)) for sha in "abc"]
+        await wait_for(lambda: queue.stats()["parked"] == 2)
+        # Parked jobs don't hold the workers, another key still runs
+        other = queue.enqueue("pull_request", {"repository": {"full_name": "owner/other"}, "pull_request": {"number": 2, "head": {"sha": "x"}}})
+        await wait_for(lambda: queue.status(other)["status"] == "done")
+        assert ran == ["a", "x"]
+        assert queue.status(jobs[1])["status"] == "queued"
+
+        release.set()
+        await wait_for(lambda: queue.status(jobs[2])["status"] == "done")
+        stats = queue.stats()
+        await queue.stop()
+        return ran, stats
+
+    ran, stats = asyncio.run(run())
+    assert ran == ["a", "x", "b", "c"]
+    assert stats["parked"] == 0 and stats["running"] == 0
+
+
+def test_superseding_a_parked_job(tmp_path):
+    async def run():
+        ran = []
+        release = asyncio.Event()
+
+        async def handler(payload):
+            ran.append(payload["pull_request"]["head"]["sha"])
+            if payload["pull_request"]["head"]["sha"] == "a":
+                await release.wait()
+
+        queue = JobQueue({"pull_request": handler}, str(tmp_path / "jobs.db"), coalesce_window=0.01)
+        queue.start()
+        running = queue.enqueue("pull_request", pr_event("a"))
+        await wait_for(lambda: queue.status(running)["status"] == "running")
+        parked = queue.enqueue("pull_request", pr_event("b"), coalesce=True)
+        await wait_for(lambda: queue.stats()["parked"] == 1)
+        newest = queue.enqueue("pull_request", pr_event("c"), coalesce=True)
+        assert queue.status(parked)["status"] == "superseded"
+        assert queue.stats()["parked"] == 0
+
+        release.set()
+        await wait_for(lambda: queue.status(newest)["status"] == "done")
+        await queue.stop()
+        return ran
+
+    assert asyncio.run(run()) == ["a", "c"]
+
+
+def test_delivery_ids_are_remembered(tmp_path):
+    async def run():
+        async def handler(payload):
+            pass
+
+        queue = JobQueue({"pull_request": handler}, str(tmp_path / "jobs.db"))
+        queue.start()
+        job_id = queue.enqueue("pull_request", pr_event("a"), delivery_id="delivery-1")
+        found = queue.find_delivery("delivery-1"), queue.find_delivery("delivery-2")
+        await queue.stop()
+        return job_id, found
+
+    job_id, found = asyncio.run(run())
+    assert found == (job_id, None)
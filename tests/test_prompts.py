@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from letta.prompts import build_prompt, count_tokens, pack_changed_files, REVIEW_INSTRUCTIONS
+
+
+def hunk(start: int, lines: int) -> str:
+    body = "".join(f"+    value_{start}_{i} = compute({i})\n" for i in range(lines))
+    return f"@@ -{start},0 +{start},{lines} @@\n{body}"
+
+
+def changed_file(filename: str, patch: str = "", **fields) -> dict:
+    return {"filename": filename, "status": "modified", "additions": 1, "deletions": 0, "patch": patch, **fields}
+
+
+def test_whole_hunks_are_dropped_with_a_note():
+    patch = hunk(1, 4) + hunk(10, 200) + hunk(300, 4)
+    files = [changed_file("app.py", patch)]
+    budget = count_tokens(hunk(1, 4)) * 4
+
+    sections, omitted = pack_changed_files(files, budget)
+
+    assert omitted == []
+    assert len(sections) == 1
+    # The large middle hunk is skipped whole, the smaller one after it still fits
+    assert hunk(1, 4) in sections[0] and hunk(300, 4).rstrip("\n") in sections[0]
+    assert "value_10_0" not in sections[0]
+    assert "[1 more hunks omitted]" in sections[0]
+
+
+def test_summaries_for_omitted_and_undiffed_files():
+    files = [
+        changed_file("small.py", hunk(1, 2)),
+        changed_file("large.py", hunk(1, 400)),
+        changed_file("image.png", status="added"),
+        changed_file("generated.py", content="x = 1\n" * 2000),
+    ]
+    budget = sum(count_tokens(f"- `{f['filename']}` (modified, +1/-0): omitted, prompt budget exhausted\n") for f in files) + count_tokens(hunk(1, 2)) * 2
+
+    sections, omitted = pack_changed_files(files, budget)
+
+    assert len(sections) == 1 and "small.py" in sections[0]
+    assert omitted == [
+        "- `large.py` (modified, +1/-0): omitted, prompt budget exhausted\n",
+        "- `image.png` (added, +1/-0): no diff available\n",
+        "- `generated.py` (modified, +1/-0): no diff available\n",
+    ]
+
+
+def test_fetched_content_stands_in_for_a_missing_diff():
+    sections, omitted = pack_changed_files([changed_file("big.sql", content="select 1;\n")], 1_000)
+    assert omitted == []
+    assert sections == ["### File: `big.sql` (no diff available, full content)\n```\nselect 1;\n```\n"]
+
+
+def test_prompt_never_exceeds_max_prompt_tokens():
+    files = [changed_file(f"module_{n}.py", "".join(hunk(i * 100, 3 + (i * n) % 40) for i in range(8))) for n in range(30)]
+    files += [changed_file(f"asset_{n}.bin") for n in range(60)]
+    related = [{"path": f"lib/helper_{n}.py", "entity_type": "function", "reason": "similar", "text": "def helper():\n    pass\n" * 20} for n in range(10)]
+
+    for max_prompt_tokens in (2_000, 8_000, 30_000):
+        prompt = build_prompt(
+            "owner/repo", "Title", "author", "feature", "main", files,
+            "## Code Changes Context", REVIEW_INSTRUCTIONS, max_prompt_tokens,
+            suffix="\n## User Question:\nwhy?\n", related_code=related,
+        )
+        assert count_tokens(prompt) <= max_prompt_tokens
+        assert prompt.endswith("\n## User Question:\nwhy?\n")
+        assert "### Files not shown" in prompt